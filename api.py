@@ -0,0 +1,156 @@
+from PIL import Image
+from cache import cache_key
+from encoders import encode
+from metrics import METRICS
+import utils
+from concurrent.futures import ThreadPoolExecutor
+import io
+import itertools
+import numpy as np
+import os
+
+# In-memory entry points for embedding the engine in another service: nothing is read from or written to
+# disk unless the caller passes a path. Sources can be encoded bytes (bytes, bytearray, memoryview), a
+# readable file object, a PIL image or a uint8 NumPy array (HxW, HxWx3 RGB or HxWx4 RGBA).
+#
+#   from api import remove_background
+#   png_bytes = remove_background(upload_bytes, output_format="png")
+#   alpha = remove_background(frame, output="mask")          # HxW uint8 array
+
+def load_source(source):
+    # -> (PIL image, encoded bytes or None). Encoded input is decoded and EXIF-rotated like files are;
+    # images and arrays are taken as they are.
+    if isinstance(source, Image.Image):
+        return source, None
+    if isinstance(source, np.ndarray):
+        shape_ok = source.ndim == 2 or (source.ndim == 3 and source.shape[2] in (3, 4))
+        if source.dtype != np.uint8 or not shape_ok:
+            raise ValueError(f"Expected a uint8 HxW, HxWx3 or HxWx4 array, got {source.dtype} {source.shape}")
+        return Image.fromarray(source), None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source) if not isinstance(source, bytes) else source
+        return utils.load_image(None, data), data
+    if isinstance(source, (str, os.PathLike)):
+        data = utils.read_input(source)
+        return utils.load_image(None, data), data
+    if hasattr(source, "read"):
+        data = source.read()
+        return utils.load_image(None, data), data
+    raise TypeError(f"Unsupported image source: {type(source).__name__}")
+
+def proxy_image(input_image, max_side=utils.PROXY_SIDE):
+    # Bounded-size copy for inference, made straight from the full image without copying it first
+    scale = max_side / max(input_image.size)
+    size = (max(1, round(input_image.width * scale)), max(1, round(input_image.height * scale)))
+    return input_image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+def full_mask(input_image, mask, refine, tile_memory_mb):
+    # Full-size alpha only, for output="mask": the RGBA result is never assembled
+    from masks import refine_mask
+
+    if refine:
+        return refine_mask(input_image, mask, tile_memory_mb=tile_memory_mb, **refine)
+    return mask.resize(input_image.size, Image.Resampling.BILINEAR) if mask.size != input_image.size else mask
+
+def _paste_into(out, result):
+    # Write result straight into the caller's array: np.asarray(result) would first copy it into a new one
+    shape = (result.height, result.width) + ((len(result.mode),) if len(result.mode) > 1 else ())
+    if out.shape != shape or out.dtype != np.uint8 or not out.flags.c_contiguous or not out.flags.writeable:
+        raise ValueError(f"out must be a writable C-contiguous uint8 array of shape {shape}")
+    target = Image.frombuffer(result.mode, result.size, out, "raw", result.mode, 0, 1)
+    # frombuffer marks the image read-only and paste would then copy it instead of writing through
+    target.readonly = 0
+    target.paste(result)
+
+def deliver(result, output_format, encoder_options, out):
+    # Encoded bytes when output_format is set, an array otherwise. out lets the caller reuse a buffer
+    # across calls: a writable file object (e.g. a BytesIO that is rewound between calls) for encoded
+    # output, or a C-contiguous uint8 array of the result's shape for array output, written in place.
+    if output_format == "mask" and result.mode == "L":
+        # Already the alpha alone; the mask encoder would look for it in an RGBA image
+        output_format = "png"
+    with METRICS.timer("stage_seconds", stage="encode"):
+        if output_format:
+            if out is not None:
+                encode(result, out, output_format, **(encoder_options or {}))
+                return out
+            buffer = io.BytesIO()
+            encode(result, buffer, output_format, **(encoder_options or {}))
+            return buffer.getvalue()
+        if out is not None:
+            _paste_into(out, result)
+            return out
+        return np.asarray(result)
+
+def remove_background(source, output="rgba", output_format=None, encoder_options=None, model_name=utils.DEFAULT_MODEL,
+                      providers=None, cache=None, refine=None, large_image_pixels=utils.LARGE_IMAGE_PIXELS,
+                      tile_memory_mb=utils.TILE_MEMORY_MB, out=None):
+    # output: "rgba" for the cut-out, "mask" for the alpha alone (HxW, or an 8-bit PNG with
+    # output_format="mask"). output_format: None for a NumPy array, or any encoders.ENCODERS name for bytes.
+    # A PIL image passed in is never modified. Errors are raised, not printed.
+    if output not in ("rgba", "mask"):
+        raise ValueError(f"Unknown output: {output} (choose rgba or mask)")
+    with METRICS.timer("stage_seconds", stage="decode"):
+        input_image, data = load_source(source)
+        # Only encoded input has stable bytes to key the mask cache on
+        key = cache_key(data, model_name) if cache is not None and data is not None else None
+        large = bool(large_image_pixels) and input_image.width * input_image.height > large_image_pixels
+        model_image = proxy_image(input_image) if large else input_image
+    with METRICS.timer("stage_seconds", stage="infer"):
+        mask = utils.cached_mask(model_image, key, model_name, providers, cache)
+    with METRICS.timer("stage_seconds", stage="postprocess"):
+        if output == "mask":
+            result = full_mask(input_image, mask, refine, tile_memory_mb)
+        else:
+            if isinstance(source, Image.Image) and input_image.mode in ("RGB", "RGBA"):
+                # postprocess attaches the alpha in place; the caller's image stays untouched. Arrays need
+                # no copy: fromarray made a new RGB image, and an RGBA view is read-only, so putalpha copies it
+                input_image = input_image.copy()
+            if large:
+                result = utils.postprocess_large(input_image, mask, tile_memory_mb, refine)
+            else:
+                result = utils.postprocess(input_image, mask, refine)
+    METRICS.inc("images_total", status="ok")
+    return deliver(result, output_format, encoder_options, out)
+
+def iter_remove_background(sources, workers=None, max_in_flight=None, errors="raise", runtime=None, **options):
+    # Stream results for an iterable of sources, in input order, while up to workers images are in progress.
+    # Sources are pulled lazily, so a generator of uploads is never read ahead by more than max_in_flight.
+    # errors="raise" stops at the first failure; errors="return" yields the exception in place of that result.
+    # Other keyword options are those of remove_background (out is not allowed: results would share it).
+    if errors not in ("raise", "return"):
+        raise ValueError(f"Unknown errors mode: {errors} (choose raise or return)")
+    if "out" in options:
+        raise TypeError("iter_remove_background does not take out")
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    model_name = options.get("model_name", utils.DEFAULT_MODEL)
+    providers = options.get("providers")
+    executor = ThreadPoolExecutor(
+        max_workers=workers,
+        initializer=utils._init_worker,
+        # Every worker keeps a warm session sized for its share of the cores
+        initargs=(itertools.count(), model_name, providers, dict(runtime or {}, workers=workers)),
+    )
+
+    def run(source):
+        try:
+            return remove_background(source, **options)
+        except Exception as e:
+            METRICS.inc("images_total", status="failed")
+            if errors == "raise":
+                raise
+            return e
+
+    pending = []
+    sources = iter(sources)
+    try:
+        for source in itertools.islice(sources, max_in_flight):
+            pending.append(executor.submit(run, source))
+        while pending:
+            result = pending.pop(0).result()
+            for source in itertools.islice(sources, 1):
+                pending.append(executor.submit(run, source))
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
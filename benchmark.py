@@ -0,0 +1,621 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+# Offline benchmarks for the processing stages. Every run prints one JSON object per case, and
+# --output/--compare store and check the results so releases can be compared against each other.
+def synthetic_image(width, height, seed=0):
+    # Smooth gradients plus noise: compresses and resamples like a real photo, unlike flat colour
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    noise = rng.normal(0, 12, (height, width, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), mode="RGB")
+
+def synthetic_mask(size=(320, 320)):
+    # A soft ellipse, the kind of low-resolution mask the model produces
+    y, x = np.mgrid[0:size[1], 0:size[0]].astype(np.float32)
+    distance = ((x - size[0] / 2) / (size[0] * 0.35)) ** 2 + ((y - size[1] / 2) / (size[1] * 0.4)) ** 2
+    return Image.fromarray((np.clip(1.5 - distance, 0, 1) * 255).astype(np.uint8), mode="L")
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def megapixel_size(megapixels):
+    # 3:2 frame with the requested pixel count
+    width = int((megapixels * 1_000_000 * 1.5) ** 0.5)
+    return width, int(width / 1.5)
+
+def sample_image(width, height, seed, with_truth=False):
+    # A fixed "product shot": a soft-edged object on a textured backdrop, different per seed.
+    # with_truth also returns the object's true alpha, for scoring masks.
+    rng = np.random.default_rng(seed)
+    image = np.asarray(synthetic_image(width, height, seed), dtype=np.float32)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    cx, cy = rng.uniform(0.35, 0.65) * width, rng.uniform(0.35, 0.65) * height
+    rx, ry = rng.uniform(0.15, 0.3) * width, rng.uniform(0.2, 0.35) * height
+    inside = np.clip(1.5 - ((x - cx) / rx) ** 2 - ((y - cy) / ry) ** 2, 0, 1)[..., None]
+    color = rng.uniform(0, 255, 3).astype(np.float32)
+    sample = Image.fromarray((image * (1 - inside) + color * inside).astype(np.uint8), mode="RGB")
+    if with_truth:
+        return sample, inside[..., 0]
+    return sample
+
+# The fixed sample set: (width, height, format), generated with the index as seed
+SAMPLE_SET = [
+    (1200, 800, "JPEG"), (800, 1200, "JPEG"), (1600, 1600, "PNG"), (2400, 1600, "JPEG"),
+    (640, 480, "PNG"), (3000, 2000, "JPEG"), (1024, 768, "JPEG"), (2000, 3000, "JPEG"),
+]
+
+def write_sample_set(directory):
+    import os
+
+    paths = []
+    for seed, (width, height, image_format) in enumerate(SAMPLE_SET):
+        path = os.path.join(directory, f"sample_{seed:02d}.{'jpg' if image_format == 'JPEG' else 'png'}")
+        sample_image(width, height, seed).save(path, format=image_format, quality=90)
+        paths.append(path)
+    return paths
+
+def sample_paths(args, directory):
+    # The user's own sample folder if one was given, otherwise the built-in fixed set
+    if args.samples:
+        from inputs import DEFAULT_PATTERNS, iter_inputs
+        return list(iter_inputs([args.samples], DEFAULT_PATTERNS, True))
+    return write_sample_set(directory)
+
+def model_available(model_name):
+    # Never let a benchmark trigger a model download; inference cases are skipped without local weights
+    import models
+    return models.is_available(model_name)
+
+def bench_postprocess(args):
+    import utils
+
+    size = megapixel_size(args.megapixels)
+    source = synthetic_image(*size)
+    low_res_mask = synthetic_mask()
+
+    def legacy():
+        # What remove_background used to do: full-size LANCZOS mask, RGBA composite, then a full RGBA resample
+        mask = low_res_mask.resize(source.size, Image.Resampling.LANCZOS)
+        empty = Image.new("RGBA", source.size, 0)
+        cutout = Image.composite(source.convert("RGBA"), empty, mask)
+        cutout.resize(source.size, Image.Resampling.LANCZOS)
+
+    def current():
+        utils.postprocess(source.copy(), low_res_mask)
+
+    copy_seconds = timed(source.copy, args.repeat)
+    yield {"case": "postprocess", "variant": "legacy", "size": size, "seconds": round(timed(legacy, args.repeat), 4)}
+    # The copy only exists so every repeat starts from the same input, so it is subtracted
+    yield {"case": "postprocess", "variant": "mask-upscale+putalpha", "size": size,
+           "seconds": round(timed(current, args.repeat) - copy_seconds, 4)}
+
+# Mask refinement variants on the same low-res mask: (label, masks.refine_mask options)
+REFINE_CASES = [
+    ("bilinear", {}),
+    ("threshold+cleanup", {"threshold": (20, 235), "cleanup": 3}),
+    ("feather", {"feather": True}),
+    ("matting", {"matting": True}),
+    ("all", {"threshold": (20, 235), "cleanup": 3, "feather": True, "matting": True}),
+]
+
+def bench_refine(args):
+    from masks import refine_mask
+
+    size = megapixel_size(args.megapixels)
+    source = synthetic_image(*size)
+    low_res_mask = synthetic_mask()
+    for label, options in REFINE_CASES:
+        seconds = timed(lambda: refine_mask(source, low_res_mask, tile_memory_mb=args.tile_memory_mb, **options),
+                        args.repeat)
+        yield {"case": "refine", "variant": label, "size": size, "seconds": round(seconds, 4)}
+
+# Encoder variants compared on the same RGBA result: (label, format, options)
+ENCODE_CASES = [
+    ("png level 1", "png", {"compress_level": 1}),
+    ("png level 3", "png", {"compress_level": 3}),
+    ("png level 6", "png", {"compress_level": 6}),
+    ("png level 9", "png", {"compress_level": 9}),
+    ("webp lossless", "webp", {}),
+    ("webp lossless fast", "webp", {"method": 0}),
+    ("webp lossy q90", "webp-lossy", {"quality": 90}),
+    ("mask", "mask", {}),
+    ("mask level 1", "mask", {"compress_level": 1}),
+]
+
+def bench_encode(args):
+    import io
+    import encoders
+    import utils
+
+    size = megapixel_size(args.megapixels)
+    result = utils.postprocess(synthetic_image(*size), synthetic_mask())
+
+    for label, output_format, options in ENCODE_CASES:
+        buffer = io.BytesIO()
+
+        def run():
+            buffer.seek(0)
+            buffer.truncate()
+            encoders.encode(result, buffer, output_format, **options)
+
+        seconds = timed(run, args.repeat)
+        yield {"case": "encode", "variant": label, "size": size, "seconds": round(seconds, 4),
+               "bytes": buffer.tell()}
+
+# Variants for the memory benchmark; each one runs in a fresh process so ru_maxrss is its own peak
+def _memory_legacy(path, args):
+    # The pre-tiling behaviour: full-size LANCZOS mask, RGBA composite and a full RGBA resample
+    source = Image.open(path)
+    source.load()
+    mask = synthetic_mask().resize(source.size, Image.Resampling.LANCZOS)
+    cutout = Image.composite(source.convert("RGBA"), Image.new("RGBA", source.size, 0), mask)
+    return cutout.resize(source.size, Image.Resampling.LANCZOS)
+
+def _memory_standard(path, args):
+    import utils
+    return utils.postprocess(utils.load_image(path), synthetic_mask())
+
+def _memory_full_frame_refine(path, args):
+    # Edge refinement over the whole frame at once, which is what tiling avoids
+    import masks
+    import utils
+    image = utils.load_image(path)
+    mask = np.asarray(synthetic_mask().resize(image.size, Image.Resampling.BILINEAR), dtype=np.float32) / 255
+    guide = np.asarray(image.convert("L"), dtype=np.float32) / 255
+    radius = masks.refine_radius(image.size, (320, 320))
+    refined = masks.guided_filter(guide, mask, radius, 1e-4)
+    image.putalpha(Image.fromarray(np.clip(refined * 255, 0, 255).astype(np.uint8), mode="L"))
+    return image
+
+def _memory_large(path, args):
+    # The large-image path without refinement: proxy decode, then a plain upscale of the mask
+    import utils
+    utils.load_proxy(path)
+    return utils.postprocess_large(utils.load_image(path), synthetic_mask(), args.tile_memory_mb)
+
+def _memory_tiled(path, args):
+    import utils
+    utils.load_proxy(path)
+    return utils.postprocess_large(utils.load_image(path), synthetic_mask(), args.tile_memory_mb, {"feather": True})
+
+MEMORY_VARIANTS = {
+    "legacy": _memory_legacy,
+    "standard": _memory_standard,
+    "large": _memory_large,
+    "full-frame-refine": _memory_full_frame_refine,
+    "tiled-refine": _memory_tiled,
+}
+
+def _reset_peak_rss():
+    # ru_maxrss survives fork/exec, so on Linux reset the high-water mark explicitly
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def memory_child(variant, path, args):
+    import utils  # noqa: F401 -- count the import cost in the baseline, not in the variant
+    import masks  # noqa: F401
+    _reset_peak_rss()
+    baseline = _peak_rss_mb()
+    MEMORY_VARIANTS[variant](path, args)
+    return {"baseline_mb": round(baseline, 1), "peak_mb": round(_peak_rss_mb(), 1)}
+
+def bench_memory(args):
+    import os
+    import subprocess
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for megapixels in args.memory_megapixels:
+            size = megapixel_size(megapixels)
+            path = os.path.join(tmp_dir, f"{megapixels}mp.jpg")
+            synthetic_image(*size).save(path, quality=90)
+
+            for variant in MEMORY_VARIANTS:
+                command = [sys.executable, os.path.abspath(__file__), "--memory-child", variant, path,
+                           "--tile-memory-mb", str(args.tile_memory_mb)]
+                output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+                record = json.loads(output)
+                working_mb = record["peak_mb"] - record["baseline_mb"]
+                yield {"case": "memory", "variant": variant, "size": size, "tile_memory_mb": args.tile_memory_mb,
+                       "peak_mb": record["peak_mb"], "working_mb": round(working_mb, 1),
+                       "bytes_per_pixel": round(working_mb * 1024 * 1024 / (size[0] * size[1]), 2)}
+
+# Runs in a fresh interpreter so every import is cold. argv: variant, image path, model, output folder.
+# "gui" only imports what the window needs; "cold" processes an image right after importing the stack;
+# "warm" calls utils.warm_up first, like the app does while the user picks files.
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+variant, path, model_name, output_dir = sys.argv[1:]
+record = {}
+if variant == "gui":
+    import ui
+    record["imports"] = time.perf_counter() - start
+else:
+    import pipeline, utils
+    record["imports"] = time.perf_counter() - start
+    if variant == "warm":
+        started = time.perf_counter()
+        utils.warm_up(model_name, workers=1)
+        record["warm_up"] = time.perf_counter() - started
+    for phase in ("first_result", "steady_result"):
+        started = time.perf_counter()
+        # Fast PNG settings, so encoding does not drown out the start-up costs
+        list(pipeline.run_pipeline([path], output_dir, workers=1, model_name=model_name,
+                                   encoder_options={"compress_level": 1}))
+        record[phase] = time.perf_counter() - started
+sys.stdout.write(json.dumps(record))
+"""
+
+def bench_startup(args):
+    # Import time and time to the first result, cold and after the warm-up, against the steady-state latency
+    import os
+    import subprocess
+    import tempfile
+
+    variants = ["gui", "cold", "warm"] if model_available(args.model) else ["gui"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "input.jpg")
+        sample_image(1600, 1200, seed=5).save(path, quality=90)
+        for variant in variants:
+            command = [sys.executable, "-c", STARTUP_SCRIPT, variant, path, args.model, tmp_dir]
+            result = subprocess.run(command, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            if result.returncode:
+                yield {"case": "startup", "variant": variant, "note": result.stderr.strip().splitlines()[-1]}
+                continue
+            for phase, seconds in json.loads(result.stdout).items():
+                yield {"case": "startup", "variant": f"{variant} {phase}", "seconds": round(seconds, 4)}
+    if len(variants) == 1:
+        yield {"case": "startup", "variant": args.model, "note": f"no local weights for {args.model}; skipped"}
+
+def bench_stages(args):
+    # Latency of every stage for one image per resolution, plus the peak RSS while processing it
+    import io
+    import os
+    import tempfile
+    import encoders
+    import utils
+
+    has_model = model_available(args.model)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for megapixels in args.resolutions:
+            size = megapixel_size(megapixels)
+            path = os.path.join(tmp_dir, f"{megapixels}mp.jpg")
+            synthetic_image(*size, seed=1).save(path, quality=90)
+            output_path = os.path.join(tmp_dir, "output.png")
+            _reset_peak_rss()
+
+            data = utils.read_input(path)
+            image = utils.load_image(path, data)
+            mask = utils.predict_mask(image, args.model) if has_model else synthetic_mask()
+            result = utils.postprocess(image.copy(), mask)
+            buffer = io.BytesIO()
+            encoders.encode(result, buffer)
+
+            def write():
+                with open(output_path, "wb") as output_file:
+                    output_file.write(buffer.getvalue())
+
+            stages = {
+                "read": lambda: utils.read_input(path),
+                "decode": lambda: utils.load_image(path, data),
+                "infer": (lambda: utils.predict_mask(image, args.model)) if has_model else None,
+                "postprocess": lambda: utils.postprocess(image.copy(), mask),
+                "encode": lambda: encoders.encode(result, io.BytesIO()),
+                "write": write,
+            }
+            record = {"case": "stages", "variant": args.model, "size": size, "peak_mb": None, "stages": {}}
+            for stage, func in stages.items():
+                record["stages"][stage] = round(timed(func, args.repeat), 4) if func else None
+            record["seconds"] = round(sum(seconds for seconds in record["stages"].values() if seconds), 4)
+            record["peak_mb"] = round(_peak_rss_mb(), 1)
+            if not has_model:
+                record["note"] = f"no local weights for {args.model}; infer skipped"
+            yield record
+
+def bench_thumbnails(args):
+    # The input grid: full decode + scale (what QPixmap did) against draft decoding and a warm cache
+    import os
+    import tempfile
+    import thumbnails
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for megapixels in args.resolutions:
+            size = megapixel_size(megapixels)
+            path = os.path.join(tmp_dir, f"{megapixels}mp.jpg")
+            synthetic_image(*size, seed=2).save(path, quality=90)
+            cache_dirs = iter(tempfile.mkdtemp(dir=tmp_dir) for _ in range(args.repeat))
+
+            def full_decode():
+                with Image.open(path) as image:
+                    image.load()
+                    image.thumbnail((100, 100), Image.Resampling.LANCZOS)
+
+            yield {"case": "thumbnail", "variant": "full-decode", "size": size,
+                   "seconds": round(timed(full_decode, args.repeat), 4)}
+            yield {"case": "thumbnail", "variant": "draft-cold", "size": size,
+                   "seconds": round(timed(lambda: thumbnails.make_thumbnail(path, 100, next(cache_dirs)), args.repeat), 4)}
+            yield {"case": "thumbnail", "variant": "cached", "size": size,
+                   "seconds": round(timed(lambda: thumbnails.make_thumbnail(path, 100, tmp_dir), args.repeat), 4)}
+
+def bench_inference(args):
+    # Model throughput on its own: the same images through one session, batch_size images per call
+    import utils
+
+    if not model_available(args.model):
+        yield {"case": "inference", "variant": args.model, "note": f"no local weights for {args.model}; skipped"}
+        return
+
+    images = [sample_image(640, 480, seed) for seed in range(args.inference_images)]
+    utils.predict_mask(images[0], args.model)
+    for batch_size in args.batch_sizes:
+        def run():
+            for i in range(0, len(images), batch_size):
+                utils.predict_masks(images[i:i + batch_size], args.model)
+
+        seconds = timed(run, args.repeat)
+        yield {"case": "inference", "variant": args.model, "batch_size": batch_size, "images": len(images),
+               "seconds": round(seconds, 4), "images_per_sec": round(len(images) / seconds, 3)}
+    utils.release_sessions()
+
+def bench_session(args):
+    # Model start-up: optimizing the graph on every load against reusing the cached optimized graph
+    import tempfile
+    import models
+
+    if not model_available(args.model):
+        yield {"case": "session", "variant": args.model, "note": f"no local weights for {args.model}; skipped"}
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cases = {
+            "optimize-on-load": lambda: models.create_session(args.model, optimized_model_dir=None),
+            "no-optimization": lambda: models.create_session(args.model, graph_optimization="disable"),
+            "cached-graph": lambda: models.create_session(args.model, optimized_model_dir=cache_dir),
+        }
+        models.create_session(args.model, optimized_model_dir=cache_dir)
+        for variant, func in cases.items():
+            yield {"case": "session", "variant": f"{args.model}:{variant}",
+                   "seconds": round(timed(func, args.repeat), 4)}
+
+def bench_batch(args):
+    # Throughput of the threaded pipeline over the sample set for each worker count and batch size
+    import tempfile
+    import pipeline
+
+    if not model_available(args.model):
+        yield {"case": "batch", "variant": args.model, "note": f"no local weights for {args.model}; skipped"}
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = sample_paths(args, tmp_dir) * args.batch_copies
+        for workers in args.workers:
+            for batch_size in args.batch_sizes:
+                with tempfile.TemporaryDirectory() as export_dir:
+                    _reset_peak_rss()
+                    start = time.perf_counter()
+                    failed = sum(bool(item.error) for item in pipeline.run_pipeline(
+                        paths, export_dir, workers=workers, model_name=args.model, batch_size=batch_size))
+                    seconds = time.perf_counter() - start
+                yield {"case": "batch", "variant": args.model, "workers": workers, "batch_size": batch_size,
+                       "images": len(paths), "failed": failed, "seconds": round(seconds, 4),
+                       "images_per_sec": round(len(paths) / seconds, 3), "peak_mb": round(_peak_rss_mb(), 1)}
+
+def bench_models(args):
+    # Latency and mask quality per model on the sample set. Quality is scored against the objects' true
+    # alpha: IoU of the thresholded mask and mean absolute alpha error.
+    import models
+    import utils
+
+    names = args.models or [name for name in models.available_models() if models.is_available(name)]
+    samples = [sample_image(width, height, seed, with_truth=True)
+               for seed, (width, height, _) in enumerate(SAMPLE_SET)]
+    for name in names:
+        if not models.is_available(name):
+            yield {"case": "models", "variant": name, "note": f"no local weights for {name}; skipped"}
+            continue
+
+        utils.predict_mask(samples[0][0], name)
+        seconds = timed(lambda: [utils.predict_mask(image, name) for image, _ in samples], args.repeat)
+        ious = []
+        errors = []
+        for image, truth in samples:
+            mask = utils.predict_mask(image, name).resize(image.size, Image.Resampling.BILINEAR)
+            alpha = np.asarray(mask, dtype=np.float32) / 255
+            predicted, actual = alpha > 0.5, truth > 0.5
+            ious.append((predicted & actual).sum() / max((predicted | actual).sum(), 1))
+            errors.append(np.abs(alpha - truth).mean())
+        yield {"case": "models", "variant": name, "seconds": round(seconds / len(samples), 4),
+               "images_per_sec": round(len(samples) / seconds, 3), "iou": round(float(np.mean(ious)), 4),
+               "mae": round(float(np.mean(errors)), 4)}
+        utils.release_sessions()
+
+# Synthetic clip for the video benchmark: an object sliding across a textured backdrop
+VIDEO_FRAMES = 48
+VIDEO_KEYFRAME_INTERVALS = [1, 4, 8, 16]
+
+def bench_video(args):
+    # Throughput and mask quality of keyframe inference plus flow propagation, against inferring every
+    # frame (interval 1). Quality is the IoU of the output alpha with the object's true outline.
+    import os
+    import tempfile
+    import cv2
+    import video
+
+    if not model_available(args.model):
+        yield {"case": "video", "variant": args.model, "note": f"no local weights for {args.model}; skipped"}
+        return
+
+    width, height = 640, 480
+    background = np.asarray(synthetic_image(width, height))[..., ::-1]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "clip.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (width, height))
+        truths = []
+        for i in range(VIDEO_FRAMES):
+            center = (width // 4 + i * 4, height // 2)
+            frame = background.copy()
+            cv2.ellipse(frame, center, (90, 130), 0, 0, 360, (40, 90, 200), -1)
+            writer.write(frame)
+            truth = np.zeros((height, width), np.uint8)
+            cv2.ellipse(truth, center, (90, 130), 0, 0, 360, 255, -1)
+            truths.append(truth > 127)
+        writer.release()
+
+        for interval in VIDEO_KEYFRAME_INTERVALS:
+            output = os.path.join(tmp_dir, f"every-{interval}")
+            report = video.remove_video_background(path, output, args.model, output_format="mask",
+                                                   encoder_options={"compress_level": 1},
+                                                   keyframe_interval=interval)
+            ious = []
+            for name, truth in zip(sorted(os.listdir(output)), truths):
+                predicted = np.asarray(Image.open(os.path.join(output, name))) > 127
+                ious.append((predicted & truth).sum() / max((predicted | truth).sum(), 1))
+            yield {"case": "video", "variant": f"{args.model} keyframe every {interval}", "frames": report["frames"],
+                   "seconds": report["seconds"], "frames_per_sec": report["frames_per_sec"],
+                   "iou": round(float(np.mean(ious)), 4)}
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "stages": bench_stages,
+    "thumbnails": bench_thumbnails,
+    "inference": bench_inference,
+    "session": bench_session,
+    "batch": bench_batch,
+    "models": bench_models,
+    "postprocess": bench_postprocess,
+    "refine": bench_refine,
+    "encode": bench_encode,
+    "memory": bench_memory,
+    "video": bench_video,
+}
+
+def record_key(record):
+    return (record["case"], record.get("variant"), tuple(record.get("size") or ()), record.get("workers"),
+            record.get("batch_size"))
+
+def metadata():
+    import os
+    import platform
+    import subprocess
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def compare(results, baseline_path, tolerance):
+    # Report every case that got slower (or lost throughput) by more than tolerance
+    with open(baseline_path, "r", encoding="utf-8") as baseline_file:
+        baseline = {record_key(record): record for record in json.load(baseline_file)["results"]}
+
+    regressions = []
+    for record in results:
+        previous = baseline.get(record_key(record))
+        if not previous:
+            continue
+        if record.get("images_per_sec") and previous.get("images_per_sec"):
+            change = previous["images_per_sec"] / record["images_per_sec"] - 1
+        elif record.get("seconds") and previous.get("seconds"):
+            change = record["seconds"] / previous["seconds"] - 1
+        else:
+            continue
+        if change > tolerance:
+            regressions.append({"regression": True, "case": record["case"], "variant": record.get("variant"),
+                                "size": record.get("size"), "workers": record.get("workers"),
+                                "batch_size": record.get("batch_size"),
+                                "slower_by": round(change, 3)})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the background removal stages (offline, synthetic inputs).")
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--model", default="u2net", help="model for the inference cases (local weights only)")
+    parser.add_argument("--models", nargs="+",
+                        help="models for the models benchmark (default: every model with local weights)")
+    parser.add_argument("--resolutions", type=float, nargs="+", default=[1, 4, 12, 24],
+                        help="synthetic image sizes in megapixels for the stage and thumbnail benchmarks")
+    parser.add_argument("--samples", help="folder of real images to use instead of the built-in sample set")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="worker counts for the batch benchmark")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8],
+                        help="images per model call for the inference and batch benchmarks")
+    parser.add_argument("--inference-images", type=int, default=32, help="images per run of the inference benchmark")
+    parser.add_argument("--batch-copies", type=int, default=4, help="times the sample set is repeated per batch")
+    parser.add_argument("--megapixels", type=float, default=24.0, help="size of the synthetic photo")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest one is reported")
+    parser.add_argument("--memory-megapixels", type=float, nargs="+", default=[12, 24, 50],
+                        help="image sizes for the memory benchmark")
+    parser.add_argument("--tile-memory-mb", type=int, default=64, help="tile working-set cap for the tiled variant")
+    parser.add_argument("--output", help="also write all results with machine metadata to this JSON file")
+    parser.add_argument("--compare", help="earlier --output file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed slowdown against --compare before a case counts as a regression")
+    parser.add_argument("--memory-child", nargs=2, metavar=("VARIANT", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.memory_child:
+        sys.stdout.write(json.dumps(memory_child(*args.memory_child, args)))
+        return 0
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    results = []
+    for name in args.benchmarks or BENCHMARKS:
+        for record in BENCHMARKS[name](args):
+            results.append(record)
+            sys.stdout.write(json.dumps(record) + "\n")
+            sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"meta": metadata(), "results": results}, output_file, indent=1)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            sys.stdout.write(json.dumps(regression) + "\n")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+from PIL import Image
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "remove-background-app", "masks")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+def cache_key(data, model_name, **params):
+    # Hash the input bytes together with everything else that changes the mask
+    digest = hashlib.sha256(data)
+    digest.update(model_name.encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+# The MaskCache of each (directory, max_bytes) in this process, for caches unpickled by pool workers
+_process_caches = {}
+_process_caches_lock = threading.Lock()
+
+def _process_cache(directory, max_bytes):
+    with _process_caches_lock:
+        cache = _process_caches.get((directory, max_bytes))
+        if cache is None:
+            cache = _process_caches[directory, max_bytes] = MaskCache(directory, max_bytes)
+    return cache
+
+class MaskCache:
+    # On-disk cache of alpha masks with a size cap; the file mtime doubles as the LRU clock
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._sizes = {}
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(".png"):
+                self._sizes[entry.path] = entry.stat().st_size
+        self._total = sum(self._sizes.values())
+
+    def __reduce__(self):
+        # Only the settings go to process pool workers, not one entry per cached file with every task;
+        # each worker process scans the folder once and keeps that cache for all of its tasks
+        return _process_cache, (self.directory, self.max_bytes)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            mask = Image.open(path)
+            mask.load()
+            # Mark as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return mask
+
+    def put(self, key, mask):
+        path = self._path(key)
+        # Write to a temporary file first so readers never see a partial mask
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                mask.save(tmp_file, format="PNG", compress_level=1)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._total -= self._sizes.get(path, 0)
+            self._sizes[path] = os.path.getsize(path)
+            self._total += self._sizes[path]
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used masks until the cache fits its cap again
+        entries = []
+        for path in self._sizes:
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                entries.append((0, path))
+        entries.sort()
+
+        for _, path in entries:
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._total -= self._sizes.pop(path)
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._sizes):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._sizes.clear()
+            self._total = 0
@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from inputs import DEFAULT_PATTERNS, iter_inputs
+
+# Headless entry point: it must never import PyQt5, so it runs on servers and in cron jobs
+
+def emit(record):
+    sys.stdout.write(json.dumps(record) + "\n")
+    sys.stdout.flush()
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Remove image backgrounds without starting the GUI. "
+                    "Progress is written to stdout as JSON lines."
+    )
+    parser.add_argument("inputs", nargs="*",
+                        help="image files, directories, or - to read paths from stdin (default, except with "
+                             "--resume)")
+    parser.add_argument("-o", "--output-dir", required=True, help="folder for the processed images")
+    parser.add_argument("-r", "--recursive", action="store_true", help="walk directories recursively")
+    parser.add_argument("-g", "--glob", action="append", dest="patterns",
+                        help="file name pattern used when walking directories (repeatable, "
+                             "default: *.png *.jpg *.jpeg)")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="number of inference workers (default: one per CPU core)")
+    parser.add_argument("-m", "--model", default="u2net",
+                        help="segmentation model, e.g. u2netp (fastest), silueta, isnet-general-use, or an INT8 "
+                             "variant such as u2netp-int8; python models.py list shows them all (default: u2net)")
+    parser.add_argument("--model-dir", help="folder with pre-staged model weights (default: ~/.u2net)")
+    parser.add_argument("--offline", action="store_true",
+                        help="never download models; fail if the weights are not in the model folder")
+    parser.add_argument("--intra-op-threads", type=int,
+                        help="ONNX Runtime threads per inference worker (default: CPU cores / workers)")
+    parser.add_argument("--inter-op-threads", type=int, help="ONNX Runtime inter-op threads (default: 1)")
+    parser.add_argument("--graph-optimization", choices=["disable", "basic", "extended", "all"], default="all",
+                        help="ONNX Runtime graph optimization level (default: all)")
+    parser.add_argument("--memory-arena", choices=["auto", "on", "off"], default="auto",
+                        help="keep ONNX Runtime's memory arena between runs; auto turns it off above two "
+                             "workers so memory does not grow with every session (default: auto)")
+    parser.add_argument("--optimized-model-dir",
+                        help="where optimized model graphs are cached for faster start-up "
+                             "(default: ~/.cache/remove-background-app/ort)")
+    parser.add_argument("--no-optimized-cache", action="store_true", help="always optimize the model graph on load")
+    parser.add_argument("-b", "--batch-size", type=int, default=1,
+                        help="images per model call in the threaded pipeline (default: 1)")
+    parser.add_argument("--processes", action="store_true",
+                        help="use a process pool instead of the threaded pipeline")
+    parser.add_argument("-f", "--format", default="png", dest="output_format",
+                        help="output format: png, webp (lossless), webp-lossy or mask (8-bit alpha only)")
+    parser.add_argument("--compress-level", type=int, choices=range(10), metavar="0-9",
+                        help="zlib level for png/mask output (default: 6; 1 is much faster)")
+    parser.add_argument("--quality", type=int, help="webp quality 0-100 (default: 90)")
+    parser.add_argument("--large-image-mp", type=float, default=16.0,
+                        help="images above this many megapixels are inferred on a 1024 px proxy, and any edge "
+                             "refinement runs in tiles (default: 16, 0 disables)")
+    parser.add_argument("--tile-memory-mb", type=int, default=64,
+                        help="working-memory ceiling for tiled mask refinement (default: 64)")
+    parser.add_argument("--threshold", type=int, nargs=2, metavar=("LOW", "HIGH"),
+                        help="mask values up to LOW become transparent, from HIGH opaque, stretched in between (0-255)")
+    parser.add_argument("--cleanup", type=int, default=0, metavar="PX",
+                        help="remove specks and fill holes up to about PX mask pixels across")
+    parser.add_argument("--feather", action="store_true",
+                        help="snap the upscaled mask edge to the image edges (guided filter)")
+    parser.add_argument("--matting", action="store_true",
+                        help="estimate partial transparency along the edge from the foreground/background colours")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="infer one image per group of near-identical frames (bursts, video stills) and reuse "
+                             "its mask, aligned, for the rest of the group")
+    parser.add_argument("--dedupe-distance", type=int, default=5, metavar="BITS",
+                        help="most differing bits of the 64-bit image hash for two images to count as near-identical "
+                             "(default: 5, 0 for exact duplicates only)")
+    parser.add_argument("--cache-dir", help="folder for cached masks (default: ~/.cache/remove-background-app/masks)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="mask cache size cap in MB (default: 1024)")
+    parser.add_argument("--no-cache", action="store_true", help="always run inference, even for known inputs")
+    parser.add_argument("--name-template", default="{name}_{hash}",
+                        help="output file name without suffix; fields: {name}, {ext}, {model} and {hash} (input "
+                             "bytes, model and output settings). The same input and settings always map to the "
+                             "same file (default: {name}_{hash})")
+    parser.add_argument("--skip-existing", action="store_true",
+                        help="skip images whose output already exists and is newer than the source")
+    parser.add_argument("--retries", type=int, default=1,
+                        help="extra attempts for an image that fails before it is recorded as failed (default: 1)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip images the batch journal in the output folder records as done; without inputs, "
+                             "reprocess the unfinished and failed images of the last batch")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and process new or changed images in the input folders")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between folder scans in --watch mode")
+    parser.add_argument("--metrics-file",
+                        help="write counters and stage histograms here when done (and every few seconds in --watch "
+                             "mode); .json for a JSON snapshot, anything else for Prometheus text")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running")
+    parser.add_argument("--profile", help="write merged cProfile stats of all pipeline threads to this file")
+    parser.add_argument("--trace", help="write a Trace Event JSON of every stage (chrome://tracing, Perfetto)")
+    return parser
+
+def item_record(item):
+    record = {
+        "input": item.input_path,
+        "output": item.output_file,
+        "seconds": round(sum(item.timings.values()), 4),
+        "timings": {stage: round(seconds, 4) for stage, seconds in item.timings.items()},
+    }
+    if item.skipped:
+        record["skipped"] = True
+    if item.attempts > 1:
+        record["attempts"] = item.attempts
+    if item.error:
+        record["error"] = item.error
+    return record
+
+def encoder_options(args):
+    options = {}
+    if args.compress_level is not None:
+        options["compress_level"] = args.compress_level
+    if args.quality is not None:
+        options["quality"] = args.quality
+    return options
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    patterns = args.patterns or DEFAULT_PATTERNS
+
+    from encoders import ENCODERS
+    import models
+    if args.output_format not in ENCODERS:
+        parser.error(f"unknown format {args.output_format!r} (choose from {', '.join(ENCODERS)})")
+    if args.output_format in ("png", "mask") and args.quality is not None:
+        parser.error("--quality only applies to webp output")
+    if args.output_format.startswith("webp") and args.compress_level is not None:
+        parser.error("--compress-level only applies to png and mask output")
+    if args.watch and args.resume:
+        parser.error("--resume does not apply to --watch, which keeps its own manifest")
+    if args.dedupe and args.processes:
+        parser.error("--dedupe needs the threaded pipeline, not --processes")
+    if not 0 <= args.dedupe_distance <= 64:
+        parser.error("--dedupe-distance must be between 0 and 64")
+    inputs = args.inputs or ([] if args.resume else ["-"])
+    if not models.is_known(args.model):
+        parser.error(f"unknown model {args.model!r} (choose from {', '.join(models.available_models())})")
+    # Environment variables, so process pool workers pick the settings up as well
+    if args.model_dir:
+        os.environ["REMOVEBG_MODEL_DIR"] = args.model_dir
+    if args.offline:
+        os.environ["REMOVEBG_OFFLINE"] = "1"
+    try:
+        args.name_template.format(name="", ext="", model="", hash="")
+    except (KeyError, IndexError, ValueError) as e:
+        parser.error(f"bad --name-template: {e!r}")
+    if args.threshold and not 0 <= args.threshold[0] < args.threshold[1] <= 255:
+        parser.error("--threshold needs 0 <= LOW < HIGH <= 255")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Imported here so --help stays instant
+    import pipeline
+    import utils
+    from cache import MaskCache, DEFAULT_CACHE_DIR
+    from journal import BatchJournal
+    from metrics import METRICS, serve_metrics
+
+    if args.profile:
+        METRICS.enable_profiling()
+    if args.trace:
+        METRICS.enable_tracing()
+    metrics_server = serve_metrics(args.metrics_port) if args.metrics_port else None
+
+    cache = None
+    if not args.no_cache:
+        cache = MaskCache(args.cache_dir or DEFAULT_CACHE_DIR, args.cache_size * 1024 * 1024)
+
+    journal = None
+    if not args.watch:
+        journal = BatchJournal(args.output_dir, resume=args.resume)
+        if inputs:
+            image_paths = journal.track(iter_inputs(inputs, patterns, args.recursive))
+        else:
+            image_paths = journal.track(journal.pending())
+    workers = args.workers or None
+    runtime = {
+        "intra_op_threads": args.intra_op_threads,
+        "inter_op_threads": args.inter_op_threads,
+        "graph_optimization": args.graph_optimization,
+        "memory_arena": {"auto": None, "on": True, "off": False}[args.memory_arena],
+    }
+    if args.no_optimized_cache:
+        runtime["optimized_model_dir"] = None
+    elif args.optimized_model_dir:
+        runtime["optimized_model_dir"] = args.optimized_model_dir
+    refine = {}
+    if args.threshold:
+        refine["threshold"] = tuple(args.threshold)
+    if args.cleanup:
+        refine["cleanup"] = args.cleanup
+    if args.feather:
+        refine["feather"] = True
+    if args.matting:
+        refine["matting"] = True
+    processing_options = {
+        "output_format": args.output_format,
+        "encoder_options": encoder_options(args),
+        "large_image_pixels": int(args.large_image_mp * 1_000_000),
+        "tile_memory_mb": args.tile_memory_mb,
+        "model_name": args.model,
+        "runtime": runtime,
+        "name_template": args.name_template,
+        "skip_existing": args.skip_existing,
+        "refine": refine or None,
+    }
+    dedupe = None
+    if args.dedupe:
+        from dedupe import DuplicateIndex
+        dedupe = DuplicateIndex(args.dedupe_distance)
+    processed = failed = 0
+    start = time.perf_counter()
+
+    try:
+        if args.watch:
+            import threading
+            from watcher import watch
+
+            stop = threading.Event()
+            last_write = time.perf_counter()
+            try:
+                for item in watch(inputs, args.output_dir, stop, args.interval, patterns, args.recursive,
+                                  workers=workers, cache=cache, batch_size=args.batch_size, dedupe=dedupe,
+                                  **processing_options):
+                    failed += bool(item.error)
+                    processed += 1
+                    emit(item_record(item))
+                    if args.metrics_file and time.perf_counter() - last_write > 10:
+                        METRICS.write(args.metrics_file)
+                        last_write = time.perf_counter()
+            except KeyboardInterrupt:
+                stop.set()
+        elif args.processes:
+            results = utils.process_images(image_paths, args.output_dir, workers=workers, use_processes=True,
+                                           cache=cache, retries=args.retries, **processing_options)
+            for image_path, output_file, seconds in results:
+                record = {"input": image_path, "output": output_file, "seconds": round(seconds, 4)}
+                if not output_file:
+                    record["error"] = "processing failed"
+                    failed += 1
+                processed += 1
+                journal.record(image_path, output_file, record.get("error"))
+                # Stage metrics stay in the worker processes; only the per-image totals reach this one
+                METRICS.inc("images_total", status="ok" if output_file else "failed")
+                METRICS.observe("image_seconds", seconds)
+                emit(record)
+        else:
+            for item in pipeline.run_pipeline(image_paths, args.output_dir, workers=workers, cache=cache,
+                                              retries=args.retries, batch_size=args.batch_size,
+                                              dedupe=dedupe, **processing_options):
+                failed += bool(item.error)
+                processed += 1
+                journal.record(item.input_path, item.output_file, item.error, item.attempts)
+                emit(item_record(item))
+    finally:
+        utils.release_sessions()
+        if journal:
+            journal.close()
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+        if args.profile:
+            METRICS.dump_profile(args.profile)
+        if args.trace:
+            METRICS.dump_trace(args.trace)
+        if metrics_server:
+            metrics_server.shutdown()
+
+    elapsed = time.perf_counter() - start
+    emit({
+        "summary": True,
+        "images": processed,
+        "failed": failed,
+        "seconds": round(elapsed, 4),
+        "images_per_sec": round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+        "cache_hits": cache.hits if cache is not None and not args.processes else None,
+        "dedupe": dedupe.report() if dedupe is not None else None,
+    })
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+from PIL import Image
+from collections import OrderedDict
+from metrics import METRICS
+import itertools
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Near-duplicate detection for bursts of almost identical frames: every image gets a 64-bit difference
+# hash, images of the same size whose hashes differ in at most max_distance bits form a group, and only
+# the first image of a group goes through the model. The others reuse its mask, shifted by the offset
+# phase correlation finds between the two frames. Exact duplicates far apart are the mask cache's job;
+# groups are only looked for among the last `window` ones, which keeps both lookups and memory bounded.
+
+DEFAULT_MAX_DISTANCE = 5
+DEFAULT_WINDOW = 64
+HASH_SIZE = 8
+# Side of the grayscale thumbnail the hash and the alignment are computed from
+THUMB_SIDE = 256
+# Below this phase-correlation peak the frames are not trusted to be shifted copies; the mask is reused as is
+MIN_ALIGN_RESPONSE = 0.2
+
+def fingerprint(image):
+    # -> (64-bit dHash, grayscale float32 thumbnail). One shrink serves both.
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+    scale = min(THUMB_SIDE / max(image.size), 1.0)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    thumb = image.resize(size, Image.Resampling.BOX, reducing_gap=2.0).convert("L")
+    small = np.asarray(thumb.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big"), np.asarray(thumb, dtype=np.float32)
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def align_mask(mask, reference_thumb, thumb):
+    # Shift the reference frame's mask by the translation between the two thumbnails
+    if reference_thumb.shape != thumb.shape:
+        return mask
+    (dx, dy), response = cv2.phaseCorrelate(reference_thumb, thumb)
+    if response < MIN_ALIGN_RESPONSE or (abs(dx) < 0.5 and abs(dy) < 0.5):
+        return mask
+    scale_x = mask.width / thumb.shape[1]
+    scale_y = mask.height / thumb.shape[0]
+    matrix = np.float32([[1, 0, dx * scale_x], [0, 1, dy * scale_y]])
+    shifted = cv2.warpAffine(np.asarray(mask), matrix, mask.size, flags=cv2.INTER_LINEAR,
+                             borderMode=cv2.BORDER_REPLICATE)
+    return Image.fromarray(shifted, mode="L")
+
+class DuplicateIndex:
+    # Shared by the decode and inference stages of one batch (or one watch session); thread-safe.
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, window=DEFAULT_WINDOW):
+        self.max_distance = max_distance
+        self.window = window
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        # group id -> (image size, hash); most recent last
+        self._groups = OrderedDict()
+        # group id -> (mask, thumbnail) of the group's first inferred image
+        self._masks = {}
+        # group id -> Event set once the group's first inference has finished (or failed)
+        self._in_flight = {}
+        self.images = 0
+        self.inferred = 0
+        self.reused = 0
+        self.infer_seconds = 0.0
+
+    def add(self, image):
+        # -> (group id, thumbnail) for a decoded image; a new group unless a recent one is close enough
+        image_hash, thumb = fingerprint(image)
+        with self._lock:
+            self.images += 1
+            for group, (size, group_hash) in reversed(self._groups.items()):
+                if size == image.size and hamming(group_hash, image_hash) <= self.max_distance:
+                    self._groups.move_to_end(group)
+                    return group, thumb
+            group = next(self._ids)
+            self._groups[group] = (image.size, image_hash)
+            while len(self._groups) > self.window:
+                old_group, _ = self._groups.popitem(last=False)
+                self._masks.pop(old_group, None)
+            return group, thumb
+
+    def infer(self, items, predict):
+        # Fill item.mask for every item. predict(items) -> masks only sees one item per group whose mask
+        # is not known yet; the rest of the group gets that mask, aligned to its own frame. Items of a group
+        # whose first image is still being inferred by another worker wait for that mask instead.
+        leaders, followers, waiting = {}, [], []
+        with self._lock:
+            for item in items:
+                if item.group in self._masks or item.group in leaders:
+                    followers.append(item)
+                elif item.group in self._in_flight:
+                    waiting.append(item)
+                else:
+                    leaders[item.group] = item
+            for group in leaders:
+                self._in_flight[group] = threading.Event()
+
+        # Own leaders first, so a worker never waits while holding up a group another worker waits for
+        try:
+            self._predict(list(leaders.values()), predict)
+        finally:
+            with self._lock:
+                for group in leaders:
+                    self._in_flight.pop(group).set()
+
+        retry = []
+        for item in waiting:
+            with self._lock:
+                event = self._in_flight.get(item.group)
+            if event:
+                event.wait()
+            if not self._reuse_known(item):
+                # The leader failed, or its group left the window meanwhile
+                retry.append(item)
+        for item in followers:
+            if item.group in leaders:
+                leader = leaders[item.group]
+                self._reuse(item, leader.mask, leader.thumb)
+            elif not self._reuse_known(item):
+                retry.append(item)
+        if retry:
+            # Through infer again, so the retried items of one group still share a single inference
+            self.infer(retry, predict)
+        for item in items:
+            item.thumb = None
+
+    def _predict(self, items, predict):
+        if not items:
+            return
+        start = time.perf_counter()
+        masks = predict(items)
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.inferred += len(items)
+            self.infer_seconds += seconds
+            for item, mask in zip(items, masks):
+                item.mask = mask
+                if item.group in self._groups and item.group not in self._masks:
+                    self._masks[item.group] = (mask, item.thumb)
+
+    def _reuse_known(self, item):
+        with self._lock:
+            known = self._masks.get(item.group)
+        if known:
+            self._reuse(item, *known)
+        return bool(known)
+
+    def _reuse(self, item, mask, reference_thumb):
+        item.mask = align_mask(mask, reference_thumb, item.thumb)
+        with self._lock:
+            self.reused += 1
+        METRICS.inc("mask_reuse_total")
+
+    def report(self):
+        # How much inference the grouping saved, estimated from the measured time per inferred image
+        with self._lock:
+            per_image = self.infer_seconds / self.inferred if self.inferred else 0.0
+            return {
+                "images": self.images,
+                "inferred": self.inferred,
+                "reused": self.reused,
+                "inference_seconds": round(self.infer_seconds, 3),
+                "inference_seconds_saved": round(self.reused * per_image, 3),
+            }
@@ -0,0 +1,40 @@
+# Output encoders: format name -> (file suffix, save function). Every save function takes the RGBA
+# result, a writable file object and the format's keyword options.
+def _save_png(image, output_file, compress_level=6):
+    # compress_level 1 is several times faster than the zlib default of 6 for slightly larger files
+    image.save(output_file, format="PNG", compress_level=compress_level)
+
+def _save_webp(image, output_file, quality=90, method=4):
+    image.save(output_file, format="WEBP", lossless=True, quality=quality, method=method)
+
+def _save_webp_lossy(image, output_file, quality=90, method=4):
+    # Lossy WebP still keeps a separate, lossless alpha plane
+    image.save(output_file, format="WEBP", lossless=False, quality=quality, method=method, alpha_quality=100)
+
+def _save_mask(image, output_file, compress_level=6):
+    # 8-bit alpha only, for compositing the original photo downstream
+    image.getchannel("A").save(output_file, format="PNG", compress_level=compress_level)
+
+ENCODERS = {
+    "png": (".png", _save_png),
+    "webp": (".webp", _save_webp),
+    "webp-lossy": (".webp", _save_webp_lossy),
+    "mask": ("_mask.png", _save_mask),
+}
+
+DEFAULT_FORMAT = "png"
+
+def register_encoder(name, suffix, save):
+    ENCODERS[name] = (suffix, save)
+
+def output_suffix(output_format=DEFAULT_FORMAT):
+    return _lookup(output_format)[0]
+
+def encode(image, output_file, output_format=DEFAULT_FORMAT, **options):
+    _lookup(output_format)[1](image, output_file, **options)
+
+def _lookup(output_format):
+    try:
+        return ENCODERS[output_format]
+    except KeyError:
+        raise ValueError(f"Unknown output format: {output_format}") from None
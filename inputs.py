@@ -0,0 +1,33 @@
+import fnmatch
+import os
+import sys
+
+# Input discovery shared by the command line and the watch folder
+DEFAULT_PATTERNS = ["*.png", "*.jpg", "*.jpeg"]
+
+def iter_inputs(inputs, patterns, recursive):
+    # Expand files, directories and "-" (one path per line on stdin) into image paths
+    for entry in inputs:
+        if entry == "-":
+            for line in sys.stdin:
+                line = line.strip()
+                if line:
+                    yield line
+        elif os.path.isdir(entry):
+            if recursive:
+                for root, dirs, files in os.walk(entry):
+                    dirs.sort()
+                    for file_name in sorted(files):
+                        if _matches(file_name, patterns):
+                            yield os.path.join(root, file_name)
+            else:
+                for file_name in sorted(os.listdir(entry)):
+                    path = os.path.join(entry, file_name)
+                    if os.path.isfile(path) and _matches(file_name, patterns):
+                        yield path
+        else:
+            yield entry
+
+def _matches(file_name, patterns):
+    file_name = file_name.lower()
+    return any(fnmatch.fnmatch(file_name, pattern.lower()) for pattern in patterns)
@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+JOURNAL_NAME = ".removebg_journal.jsonl"
+
+class BatchJournal:
+    # Append-only record of every image in a batch: pending, done (with its output) or failed (with the error).
+    # One JSON line per change, flushed right away, so a crash loses at most the line being written and a
+    # rerun with resume=True only processes what is not done yet. The last line for an input wins.
+    def __init__(self, export_path, resume=False):
+        self.path = os.path.join(export_path, JOURNAL_NAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if resume and os.path.exists(self.path):
+            self._load()
+            self._compact()
+        os.makedirs(export_path, exist_ok=True)
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A half-written last line from a crash
+                    continue
+                self.entries[entry["input"]] = entry
+
+    def _compact(self):
+        # Rewrite the journal with one line per input so it does not grow with every resume
+        directory = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            for entry in self.entries.values():
+                tmp_file.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _write(self, entry):
+        with self._lock:
+            self.entries[entry["input"]] = entry
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def is_done(self, input_path):
+        entry = self.entries.get(os.path.abspath(input_path))
+        return bool(entry and entry["status"] == "done" and entry.get("output")
+                    and os.path.exists(self._output_file(entry["output"])))
+
+    def _output_file(self, output_file):
+        # Outputs are recorded as absolute paths; older journals hold them relative to whatever directory
+        # that run started in, so those are looked up next to the journal instead
+        if os.path.isabs(output_file):
+            return output_file
+        return os.path.join(os.path.dirname(self.path), os.path.basename(output_file))
+
+    def track(self, image_paths):
+        # Pass through the images that still need work, recording each one as pending
+        for image_path in image_paths:
+            if self.is_done(image_path):
+                continue
+            self._write({"input": os.path.abspath(image_path), "status": "pending", "time": time.time()})
+            yield image_path
+
+    def record(self, input_path, output_file=None, error=None, attempts=1):
+        entry = {
+            "input": os.path.abspath(input_path),
+            "status": "done" if output_file and not error else "failed",
+            # Absolute, so a resume from another working directory still finds it
+            "output": os.path.abspath(output_file) if output_file else None,
+            "attempts": attempts,
+            "time": time.time(),
+        }
+        if error:
+            entry["error"] = error
+        self._write(entry)
+
+    def pending(self):
+        # Inputs of earlier runs that never finished or failed, in the order they were first seen
+        return [input_path for input_path in self.entries if not self.is_done(input_path)]
+
+    def progress(self, image_paths):
+        # (done, failed) among image_paths
+        done = failed = 0
+        for image_path in image_paths:
+            entry = self.entries.get(os.path.abspath(image_path))
+            if self.is_done(image_path):
+                done += 1
+            elif entry and entry["status"] == "failed":
+                failed += 1
+        return done, failed
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
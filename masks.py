@@ -0,0 +1,163 @@
+from PIL import Image
+import math
+
+import cv2
+import numpy as np
+
+# Mask refinement written as whole-array operations (NumPy / OpenCV), no per-pixel Python loops
+
+def guided_filter(guide, src, radius, eps, subsample=1):
+    # Edge-preserving smoothing of src that follows the edges of guide (both float32, 0..1).
+    # With subsample > 1 the linear coefficients are fitted on a shrunken copy and applied at full size
+    # (the "fast guided filter"), which cuts the cost by about subsample squared.
+    full_guide = guide
+    if subsample > 1:
+        small_size = (max(1, guide.shape[1] // subsample), max(1, guide.shape[0] // subsample))
+        guide = cv2.resize(guide, small_size, interpolation=cv2.INTER_AREA)
+        src = cv2.resize(src, small_size, interpolation=cv2.INTER_AREA)
+        radius = max(1, radius // subsample)
+
+    size = (2 * radius + 1, 2 * radius + 1)
+    mean_i = cv2.boxFilter(guide, -1, size)
+    mean_p = cv2.boxFilter(src, -1, size)
+    cov_ip = cv2.boxFilter(guide * src, -1, size) - mean_i * mean_p
+    var_i = cv2.boxFilter(guide * guide, -1, size) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a = cv2.boxFilter(a, -1, size)
+    mean_b = cv2.boxFilter(b, -1, size)
+
+    if subsample > 1:
+        full_size = (full_guide.shape[1], full_guide.shape[0])
+        mean_a = cv2.resize(mean_a, full_size, interpolation=cv2.INTER_LINEAR)
+        mean_b = cv2.resize(mean_b, full_size, interpolation=cv2.INTER_LINEAR)
+    return mean_a * full_guide + mean_b
+
+def refine_radius(image_size, mask_size):
+    # The low-res mask is blurry over roughly one upscale step, so filter over about that many pixels
+    scale = max(image_size[0] / mask_size[0], image_size[1] / mask_size[1])
+    return int(min(max(math.ceil(scale), 4), 32))
+
+def tile_side(tile_memory_mb, bytes_per_pixel=48):
+    # The guided filter keeps about a dozen float32 planes per tile alive at once
+    return max(256, int(math.sqrt(tile_memory_mb * 1024 * 1024 / bytes_per_pixel)))
+
+def threshold_mask(mask, low=None, high=None):
+    # Soft threshold on a uint8 mask: at or below low becomes 0, at or above high 255, linear in between
+    low = 0 if low is None else low
+    high = 255 if high is None else high
+    if low <= 0 and high >= 255:
+        return mask
+    scale = 255.0 / max(high - low, 1)
+    return np.clip((mask.astype(np.float32) - low) * scale + 0.5, 0, 255).astype(np.uint8)
+
+def clean_mask(mask, size):
+    # Morphological open (drops specks in the background) then close (fills pinholes in the subject),
+    # with an elliptical kernel of size pixels
+    if size < 2:
+        return mask
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+def band_matting(rgb, alpha, radius, solid=0.98, subsample=1):
+    # Re-estimate alpha inside the edge band from colour: every band pixel is explained as a mix of the
+    # mean definite-foreground colour F and definite-background colour B around it, so
+    # alpha = (I - B).(F - B) / |F - B|^2. rgb is uint8 HxWx3 and alpha float32 HxW (0..1).
+    # With subsample > 1 the estimate is made on a copy shrunk by subsample and interpolated back up; it is
+    # still finer than the model's mask, which is what the band replaces.
+    fg = alpha >= solid
+    bg = alpha <= 1 - solid
+    band = ~(fg | bg)
+    if not band.any():
+        return alpha
+
+    small_rgb, small_alpha = rgb, alpha
+    if subsample > 1:
+        small_size = (max(1, rgb.shape[1] // subsample), max(1, rgb.shape[0] // subsample))
+        small_rgb = cv2.resize(rgb, small_size, interpolation=cv2.INTER_AREA)
+        small_alpha = cv2.resize(alpha, small_size, interpolation=cv2.INTER_AREA)
+        radius = max(1, radius // subsample)
+    small_fg = (small_alpha >= solid).astype(np.float32)
+    small_bg = (small_alpha <= 1 - solid).astype(np.float32)
+
+    small_rgb = small_rgb.astype(np.float32) / 255
+    size = (2 * radius + 1, 2 * radius + 1)
+    fg_weight = cv2.boxFilter(small_fg, -1, size, normalize=False)
+    bg_weight = cv2.boxFilter(small_bg, -1, size, normalize=False)
+    fg_mean = cv2.boxFilter(small_rgb * small_fg[..., None], -1, size, normalize=False)
+    fg_mean /= np.maximum(fg_weight, 1)[..., None]
+    bg_mean = cv2.boxFilter(small_rgb * small_bg[..., None], -1, size, normalize=False)
+    bg_mean /= np.maximum(bg_weight, 1)[..., None]
+
+    diff = fg_mean - bg_mean
+    contrast = (diff * diff).sum(axis=2)
+    estimate = ((small_rgb - bg_mean) * diff).sum(axis=2) / (contrast + 1e-3)
+    np.clip(estimate, 0, 1, out=estimate)
+    known = (fg_weight > 0) & (bg_weight > 0)
+    # Where foreground and background colours are alike the estimate means little; keep the model's alpha there
+    weight = np.where(known, np.clip(contrast * 20, 0, 1), 0).astype(np.float32)
+
+    # Only the estimate and its weight are brought up to full size, and they only change the band
+    if subsample > 1:
+        height, width = alpha.shape
+        estimate = cv2.resize(estimate, (width, height), interpolation=cv2.INTER_LINEAR)
+        weight = cv2.resize(weight, (width, height), interpolation=cv2.INTER_LINEAR)
+    weight[~band] = 0
+    return alpha + weight * (estimate - alpha)
+
+def upscale_mask_tiled(image, mask, tile_memory_mb=64, refine=True, eps=1e-4, matting=False):
+    # Upscale a low-res mask to the size of image one tile at a time, refining only tiles that contain an edge:
+    # refine feathers the edge with a guided filter, matting first re-estimates alpha from colour in the edge band.
+    # Working memory is bounded by tile_memory_mb no matter how many pixels the image has.
+    width, height = image.size
+    scale_x = mask.width / width
+    scale_y = mask.height / height
+    radius = refine_radius(image.size, mask.size)
+    # Fit the filters on a grid about a quarter of the radius apart; the edge band is several radii wide
+    subsample = max(1, radius // 4)
+    side = tile_side(tile_memory_mb)
+    margin = 2 * radius
+
+    out = np.empty((height, width), dtype=np.uint8)
+    for y0 in range(0, height, side):
+        for x0 in range(0, width, side):
+            x1 = min(x0 + side, width)
+            y1 = min(y0 + side, height)
+            # Pad each tile so the filter sees the neighbouring pixels and no seams appear
+            px0, py0 = max(x0 - margin, 0), max(y0 - margin, 0)
+            px1, py1 = min(x1 + margin, width), min(y1 + margin, height)
+
+            tile = np.asarray(mask.resize(
+                (px1 - px0, py1 - py0), Image.Resampling.BILINEAR,
+                box=(px0 * scale_x, py0 * scale_y, px1 * scale_x, py1 * scale_y),
+            ))
+
+            if (refine or matting) and tile.min() < 250 and tile.max() > 5:
+                crop = image.crop((px0, py0, px1, py1))
+                alpha = tile.astype(np.float32) / 255
+                if matting:
+                    rgb = np.asarray(crop.convert("RGB"))
+                    alpha = band_matting(rgb, alpha, radius, subsample=subsample)
+                if refine:
+                    guide = np.asarray(crop.convert("L"), dtype=np.float32) / 255
+                    alpha = guided_filter(guide, alpha, radius, eps, subsample)
+                tile = np.clip(alpha * 255 + 0.5, 0, 255).astype(np.uint8)
+
+            out[y0:y1, x0:x1] = tile[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+    return Image.fromarray(out, mode="L")
+
+def refine_mask(image, mask, threshold=None, cleanup=0, feather=False, matting=False, tile_memory_mb=64):
+    # Full refinement of a low-res model mask into a full-size alpha for image. Threshold and cleanup run at
+    # the mask's native resolution, where they cost next to nothing; feathering and matting run on the
+    # full-size edge band only.
+    low_res = np.asarray(mask.convert("L"))
+    if threshold:
+        low_res = threshold_mask(low_res, *threshold)
+    if cleanup:
+        low_res = clean_mask(low_res, cleanup)
+    mask = Image.fromarray(low_res, mode="L")
+    if not feather and not matting:
+        return mask.resize(image.size, Image.Resampling.BILINEAR) if mask.size != image.size else mask
+    return upscale_mask_tiled(image, mask, tile_memory_mb, refine=feather, matting=matting)
@@ -0,0 +1,225 @@
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+
+# Process-wide instrumentation: counters and latency histograms for every stage, plus optional
+# cProfile and trace-event capture. Everything is kept in memory and exported on demand.
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+class Metrics:
+    def __init__(self, prefix="removebg"):
+        self.prefix = prefix
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._profiles = None
+        self._trace = None
+        self._trace_origin = time.perf_counter()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        # Observe the duration of the block into histogram name, also when it raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.observe(name, end - start, **labels)
+            self.span(name, start, end, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), "count": histogram.count,
+                           "sum": round(histogram.sum, 6),
+                           "mean": round(histogram.sum / histogram.count, 6) if histogram.count else 0.0}
+                          for (name, labels), histogram in sorted(self._histograms.items())]
+        return {"uptime": round(time.time() - self.started, 3), "counters": counters, "histograms": histograms}
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                metric = f"{self.prefix}_{name}"
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# TYPE {metric} histogram")
+                for bound, count in histogram.cumulative():
+                    lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+        lines.append(f"{self.prefix}_uptime_seconds {time.time() - self.started:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # .json gets the snapshot, anything else the Prometheus text (e.g. for node_exporter's textfile collector)
+        if path.endswith(".json"):
+            data = json.dumps(self.snapshot(), indent=1)
+        else:
+            data = self.render()
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+
+    # Profiling: cProfile only sees the thread it was enabled on, so every worker thread gets its own
+    # profiler and the results are merged when they are dumped.
+    def enable_profiling(self):
+        self._profiles = []
+
+    @contextlib.contextmanager
+    def profile_thread(self):
+        if self._profiles is None:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profiles.append(profiler)
+
+    def dump_profile(self, path):
+        with self._lock:
+            profiles = list(self._profiles or [])
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0])
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        stats.dump_stats(path)
+
+    # Tracing: one complete event per timed span, in the Trace Event format chrome://tracing and Perfetto read
+    def enable_tracing(self):
+        self._trace = []
+
+    def span(self, name, start, end, **args):
+        if self._trace is None:
+            return
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": round((start - self._trace_origin) * 1e6),
+            "dur": round((end - start) * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.current_thread().name,
+            "args": args,
+        }
+        with self._lock:
+            self._trace.append(event)
+
+    def dump_trace(self, path):
+        with self._lock:
+            events = list(self._trace or [])
+        with open(path, "w", encoding="utf-8") as trace_file:
+            json.dump({"traceEvents": events}, trace_file)
+
+METRICS = Metrics()
+
+def serve_metrics(port, host="127.0.0.1", metrics=METRICS):
+    # Serve /metrics in Prometheus text format from a daemon thread; returns the server for shutdown()
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def throughput(done, total, elapsed):
+    # (images per second, seconds left) for a batch that is done/total through after elapsed seconds
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 and total else None
+    return rate, eta
+
+def status_line(done, total, elapsed):
+    rate, eta = throughput(done, total, elapsed)
+    status = f"{done}/{total} images · {rate:.2f} img/s"
+    if eta is not None:
+        minutes, seconds = divmod(int(eta + 0.5), 60)
+        status += f" · ETA {minutes}:{seconds:02d}"
+    return status
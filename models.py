@@ -0,0 +1,222 @@
+import argparse
+import os
+import sys
+import threading
+
+# Registry of the segmentation models the app can use. Kept free of rembg/onnxruntime imports so the
+# UI can list the models without loading either.
+
+U2NET_NORMALIZATION = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
+ISNET_NORMALIZATION = ((0.485, 0.456, 0.406), (1.0, 1.0, 1.0))
+
+# name -> (description, input normalization (mean, std, size) or None). Models with an input spec are
+# run directly on their ONNX session and keep the mask at native resolution; the others (None) use
+# rembg's own pre/post-processing.
+MODELS = {
+    "u2net": ("U-2-Net, general purpose (176 MB)", U2NET_NORMALIZATION + ((320, 320),)),
+    "u2netp": ("U-2-Net small, fastest on CPU (4.7 MB)", U2NET_NORMALIZATION + ((320, 320),)),
+    "silueta": ("U-2-Net reduced, close to u2net quality (43 MB)", U2NET_NORMALIZATION + ((320, 320),)),
+    "u2net_human_seg": ("U-2-Net trained on people", U2NET_NORMALIZATION + ((320, 320),)),
+    "isnet-general-use": ("IS-Net, sharper edges, slower (1024 px input)", ISNET_NORMALIZATION + ((1024, 1024),)),
+    "isnet-anime": ("IS-Net for anime characters", ISNET_NORMALIZATION + ((1024, 1024),)),
+    "birefnet-general-lite": ("BiRefNet lite, high quality, slow on CPU", None),
+    "birefnet-general": ("BiRefNet, best quality, very slow on CPU", None),
+    "birefnet-portrait": ("BiRefNet for portraits", None),
+}
+
+# An INT8-quantized variant of model X is called "X-int8" and lives in the model folder as X-int8.onnx
+QUANTIZED_SUFFIX = "-int8"
+
+# Weights are looked up in REMOVEBG_MODEL_DIR (default: rembg's ~/.u2net). With REMOVEBG_OFFLINE set,
+# a missing model is an error instead of a download. Both are environment variables so spawned
+# worker processes see the same settings.
+def model_dir():
+    directory = os.environ.get("REMOVEBG_MODEL_DIR")
+    if not directory:
+        directory = os.getenv("U2NET_HOME", os.path.join(os.getenv("XDG_DATA_HOME", "~"), ".u2net"))
+    return os.path.expanduser(directory)
+
+def is_offline():
+    return os.environ.get("REMOVEBG_OFFLINE", "") not in ("", "0")
+
+def base_model(model_name):
+    if model_name.endswith(QUANTIZED_SUFFIX):
+        return model_name[:-len(QUANTIZED_SUFFIX)]
+    return model_name
+
+def is_known(model_name):
+    return base_model(model_name) in MODELS
+
+def model_file(model_name):
+    return os.path.join(model_dir(), f"{model_name}.onnx")
+
+def is_available(model_name):
+    # Weights already on disk, so the model can be used without network access
+    return os.path.exists(model_file(model_name))
+
+def model_input(model_name):
+    # (mean, std, size) for the models we run ourselves, None for the ones that go through rembg
+    return MODELS[base_model(model_name)][1] if is_known(model_name) else None
+
+def describe(model_name):
+    description = MODELS[base_model(model_name)][0]
+    if model_name.endswith(QUANTIZED_SUFFIX):
+        description += ", INT8"
+    return description
+
+def available_models():
+    # Every registered model, plus the quantized variants that have been created in the model folder
+    names = list(MODELS)
+    for name in MODELS:
+        if is_available(name + QUANTIZED_SUFFIX):
+            names.insert(names.index(name) + 1, name + QUANTIZED_SUFFIX)
+    return names
+
+# ONNX Runtime settings. Left at None they are derived from the number of inference workers sharing the
+# machine: the cores are split between the workers so their intra-op thread pools do not fight, and with
+# more than two workers every session frees its buffers after each run instead of keeping a growing arena.
+GRAPH_OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+DEFAULT_OPTIMIZED_MODEL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "remove-background-app", "ort")
+
+def session_settings(workers=1, intra_op_threads=None, inter_op_threads=None, graph_optimization="all",
+                     memory_arena=None, optimized_model_dir=DEFAULT_OPTIMIZED_MODEL_DIR):
+    workers = max(workers or 1, 1)
+    if intra_op_threads is None:
+        if "OMP_NUM_THREADS" in os.environ:
+            intra_op_threads = int(os.environ["OMP_NUM_THREADS"])
+        else:
+            intra_op_threads = max(1, (os.cpu_count() or 1) // workers)
+    return {
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads or 1,
+        "graph_optimization": graph_optimization,
+        "memory_arena": workers <= 2 if memory_arena is None else memory_arena,
+        "optimized_model_dir": optimized_model_dir,
+    }
+
+def session_options(settings):
+    import onnxruntime as ort
+
+    levels = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    sess_opts = ort.SessionOptions()
+    sess_opts.intra_op_num_threads = settings["intra_op_threads"]
+    sess_opts.inter_op_num_threads = settings["inter_op_threads"]
+    sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    sess_opts.graph_optimization_level = levels[settings["graph_optimization"]]
+    sess_opts.enable_cpu_mem_arena = settings["memory_arena"]
+    sess_opts.enable_mem_pattern = settings["memory_arena"]
+    return sess_opts
+
+def optimized_model_file(model_path, settings):
+    # Optimized graphs can contain CPU-specific kernels, so the key covers the machine and runtime version
+    import hashlib
+    import platform
+    import onnxruntime as ort
+
+    stat = os.stat(model_path)
+    key = "|".join(str(part) for part in (
+        os.path.abspath(model_path), stat.st_mtime_ns, stat.st_size, settings["graph_optimization"],
+        ort.__version__, platform.machine(), platform.processor(),
+    ))
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(settings["optimized_model_dir"], f"{name}-{digest}.ort.onnx")
+
+def _session_class(model_name):
+    from rembg.sessions import sessions_class
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class
+    raise ValueError(f"rembg has no session for {model_name}")
+
+def _rembg_session(model_name, sess_opts, providers):
+    # rembg's session classes look for their weights in U2NET_HOME, not in model_dir(), and download them
+    # when the file is missing or its checksum differs
+    os.environ["U2NET_HOME"] = model_dir()
+    if is_offline():
+        # Staged weights are used as they are; a checksum mismatch must not turn into a download
+        os.environ["MODEL_CHECKSUM_DISABLED"] = "1"
+    return _session_class(model_name)(model_name, sess_opts, providers)
+
+def create_session(model_name, providers=None, **settings):
+    # settings: keyword arguments of session_settings
+    from rembg.sessions.u2net_custom import U2netCustomSession
+    import onnxruntime as ort
+
+    if not is_known(model_name):
+        raise ValueError(f"Unknown model: {model_name} (choose from {', '.join(available_models())})")
+    settings = session_settings(**settings)
+    sess_opts = session_options(settings)
+
+    path = model_file(model_name)
+    if not os.path.exists(path):
+        if model_name.endswith(QUANTIZED_SUFFIX):
+            raise FileNotFoundError(f"{path} not found; create it with: python models.py quantize "
+                                    f"{base_model(model_name)}")
+        if is_offline():
+            raise FileNotFoundError(f"{path} not found and downloads are disabled (offline mode)")
+        if model_input(model_name) is None:
+            # rembg runs these models end to end, so they need rembg's own session class
+            return _rembg_session(model_name, sess_opts, providers)
+        # rembg downloads into U2NET_HOME; point it at the model folder so later runs find the weights there
+        os.environ["U2NET_HOME"] = model_dir()
+        path = str(_session_class(model_name).download_models())
+    elif model_input(model_name) is None:
+        return _rembg_session(model_name, sess_opts, providers)
+
+    # The models we run ourselves are loaded from a file as they are: no checksum round trip
+    if not settings["optimized_model_dir"] or settings["graph_optimization"] == "disable":
+        return U2netCustomSession(model_name, sess_opts, providers, model_path=path)
+
+    optimized = optimized_model_file(path, settings)
+    if os.path.exists(optimized):
+        # Already optimized when it was saved; loading it skips the graph transformations
+        sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return U2netCustomSession(model_name, sess_opts, providers, model_path=optimized)
+
+    # Save the optimized graph for the next start; a temporary name keeps parallel workers from reading
+    # a half-written file
+    os.makedirs(settings["optimized_model_dir"], exist_ok=True)
+    tmp_path = f"{optimized}.{os.getpid()}-{threading.get_ident()}.tmp"
+    sess_opts.optimized_model_filepath = tmp_path
+    session = U2netCustomSession(model_name, sess_opts, providers, model_path=path)
+    try:
+        os.replace(tmp_path, optimized)
+    except OSError:
+        pass
+    return session
+
+def quantize_model(model_name):
+    # Write an INT8 (dynamic, weight-only) copy of a locally available model next to it
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = model_file(model_name)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"{source} not found; run the model once or copy its weights there first")
+    target = model_file(model_name + QUANTIZED_SUFFIX)
+    quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+    return target
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List the background removal models or create INT8 variants.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show every model and whether its weights are available offline")
+    quantize_parser = commands.add_parser("quantize", help="write an INT8-quantized copy of a local model")
+    quantize_parser.add_argument("model", choices=[name for name, spec in MODELS.items() if spec[1]])
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name in available_models():
+            status = "local" if is_available(name) else "download"
+            print(f"{name:24} {status:9} {describe(name)}")
+    else:
+        print(quantize_model(args.model))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+from queue import Queue, Empty, Full
+import itertools
+import os
+import sys
+import threading
+import time
+
+from metrics import METRICS
+import thumbnails
+import utils
+
+# Marks the end of the stream on every stage queue
+_STOP = object()
+
+class PipelineItem:
+    def __init__(self, index, input_path):
+        self.index = index
+        self.input_path = input_path
+        self.data = None
+        self.cache_key = None
+        self.image = None
+        self.mask = None
+        # Near-duplicate group and grayscale thumbnail, when the batch reuses masks (dedupe.py)
+        self.group = None
+        self.thumb = None
+        # Large images only carry a bounded-size proxy until post-processing
+        self.large = False
+        self.output_image = None
+        # Where the result goes, and output_file once it has actually been written (or was already up to date)
+        self.target_file = None
+        self.output_file = None
+        self.skipped = False
+        # PNG bytes of a small preview, when the caller asked for one
+        self.thumbnail = None
+        self.error = None
+        # Tries of the stage that needed the most, 1 when nothing had to be retried
+        self.attempts = 1
+        # Seconds spent in each stage, filled in as the item moves along
+        self.timings = {}
+
+def _put(queue, item, stop):
+    # Block on a full queue, but give up as soon as the pipeline is stopped
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+# How long a batched stage waits for more items after the first one before running a partial batch
+BATCH_WAIT = 0.02
+
+def _run_stage(name, func, inbox, outbox, stop, workers_left, next_workers, setup=None, retries=0,
+               batch_size=None):
+    setup_error = None
+    if setup:
+        try:
+            setup()
+        except Exception as e:
+            # A worker that cannot start (e.g. the model failed to load) fails its items instead of hanging
+            print(f"Error removing background: {e}", file=sys.stderr)
+            setup_error = str(e)
+
+    try:
+        with METRICS.profile_thread():
+            _stage_loop(name, func, inbox, outbox, stop, setup_error, retries, batch_size)
+    finally:
+        # The last worker of a stage closes the stream for every worker of the next one
+        with workers_left["lock"]:
+            workers_left["count"] -= 1
+            last = workers_left["count"] == 0
+        if last:
+            for _ in range(next_workers):
+                if not _put(outbox, _STOP, stop):
+                    break
+
+def _take_batch(inbox, first, batch_size):
+    # Add whatever else arrives shortly after first, up to batch_size items; also report a _STOP seen on the way
+    batch = [first]
+    deadline = time.perf_counter() + BATCH_WAIT
+    while len(batch) < batch_size:
+        try:
+            item = inbox.get(timeout=max(deadline - time.perf_counter(), 0))
+        except Empty:
+            break
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+def _stage_loop(name, func, inbox, outbox, stop, setup_error, retries, batch_size):
+    # batch_size None: func takes one item. Otherwise func takes a list of up to batch_size items.
+    stopped = False
+    while not stop.is_set() and not stopped:
+        try:
+            item = inbox.get(timeout=0.1)
+        except Empty:
+            continue
+        if item is _STOP:
+            break
+
+        batch = [item]
+        if batch_size and batch_size > 1:
+            batch, stopped = _take_batch(inbox, item, batch_size)
+
+        todo = [item for item in batch if item.error is None and not item.skipped]
+        if todo and setup_error:
+            for item in todo:
+                item.error = setup_error
+                item.image = item.mask = item.output_image = None
+        elif todo:
+            start = time.perf_counter()
+            if len(todo) > 1:
+                METRICS.inc("batches_total", stage=name)
+                try:
+                    func(todo)
+                except Exception as e:
+                    # Fall back to one item at a time, so only the image that breaks the batch fails
+                    print(f"Error removing background: {e}", file=sys.stderr)
+                    for item in todo:
+                        _run_item(name, func, item, retries, batched=True)
+            else:
+                _run_item(name, func, todo[0], retries, batched=bool(batch_size))
+            end = time.perf_counter()
+            for item in todo:
+                item.timings[name] = end - start
+                METRICS.observe("stage_seconds", end - start, stage=name)
+                METRICS.span(name, start, end, input=item.input_path)
+
+        for item in batch:
+            if not _put(outbox, item, stop):
+                return
+
+def _run_item(name, func, item, retries, batched=False):
+    for attempt in range(retries + 1):
+        item.attempts = max(item.attempts, attempt + 1)
+        try:
+            func([item] if batched else item)
+            item.error = None
+            break
+        except Exception as e:
+            print(f"Error removing background: {e}", file=sys.stderr)
+            item.error = str(e)
+            METRICS.inc("stage_errors_total", stage=name)
+    if item.error:
+        # Only this item fails; free its decoded pixels right away and let the rest of the batch go on
+        item.image = item.mask = item.output_image = None
+
+def _make_decode(export_path, model_name, cache, large_image_pixels, output_format, name_template, skip_existing,
+                 dedupe=None, settings=None):
+    def decode(item):
+        item.data = utils.read_input(item.input_path)
+        if cache is not None or utils.needs_hash(name_template):
+            item.cache_key = utils.cache_key(item.data, model_name)
+        item.target_file = utils.output_path(item.input_path, export_path, output_format, name_template,
+                                             item.cache_key, model_name, settings)
+        if skip_existing and utils.is_up_to_date(item.input_path, item.target_file):
+            # Nothing left to do: the later stages pass the item straight through
+            item.skipped = True
+            item.output_file = item.target_file
+            item.data = None
+            return
+        item.large = utils.is_large_image(item.input_path, item.data, large_image_pixels)
+        if item.large:
+            item.image = utils.load_proxy(item.input_path, item.data)
+        else:
+            item.image = utils.load_image(item.input_path, item.data)
+        item.data = None
+        if dedupe is not None:
+            item.group, item.thumb = dedupe.add(item.image)
+    return decode
+
+def _make_infer(model_name, providers, cache, dedupe=None):
+    def predict(items):
+        # Cache misses of the whole batch go through the model in one call
+        return utils.cached_masks([item.image for item in items], [item.cache_key for item in items],
+                                  model_name, providers, cache)
+
+    def infer(items):
+        if dedupe is not None:
+            # Only one image per near-duplicate group reaches the model
+            dedupe.infer(items, predict)
+            return
+        for item, mask in zip(items, predict(items)):
+            item.mask = mask
+    return infer
+
+def _make_postprocess(tile_memory_mb, refine):
+    def postprocess(item):
+        if item.large:
+            # The full-resolution pixels are only decoded now, one large image per post-process worker
+            item.image = None
+            item.output_image = utils.postprocess_large(utils.load_image(item.input_path), item.mask,
+                                                        tile_memory_mb, refine)
+        else:
+            item.output_image = utils.postprocess(item.image, item.mask, refine)
+        item.image = item.mask = None
+    return postprocess
+
+def _make_encode(output_format, encoder_options, thumbnail_size):
+    def encode(item):
+        item.output_file = utils.save_output(item.output_image, item.target_file, output_format, encoder_options)
+        if thumbnail_size:
+            # Build the preview from the result still in memory instead of re-reading the file later
+            item.thumbnail = thumbnails.thumbnail_bytes(item.output_image, thumbnail_size)
+        item.output_image = None
+    return encode
+
+def build_stages(export_path, model_name=utils.DEFAULT_MODEL, providers=None, cache=None,
+                 output_format=utils.DEFAULT_FORMAT, encoder_options=None, thumbnail_size=None,
+                 large_image_pixels=utils.LARGE_IMAGE_PIXELS, tile_memory_mb=utils.TILE_MEMORY_MB,
+                 name_template=utils.DEFAULT_NAME_TEMPLATE, skip_existing=False, refine=None, dedupe=None):
+    # (name, func) of every stage in order. infer takes a list of items, the other stages a single item.
+    # dedupe: a dedupe.DuplicateIndex to reuse masks across near-identical images, None to infer every image.
+    return [
+        ("decode", _make_decode(export_path, model_name, cache, large_image_pixels, output_format, name_template,
+                                skip_existing, dedupe,
+                                utils.output_settings(encoder_options, refine, large_image_pixels, tile_memory_mb))),
+        ("infer", _make_infer(model_name, providers, cache, dedupe)),
+        ("postprocess", _make_postprocess(tile_memory_mb, refine)),
+        ("encode", _make_encode(output_format, encoder_options, thumbnail_size)),
+    ]
+
+# Error of an item that was cancelled before it finished
+CANCELLED = "cancelled"
+
+def process_item(item, stages, retries=0, cancelled=None):
+    # Run one item through every stage on the calling thread, for callers that schedule items themselves.
+    # cancelled() is checked before each stage, so a cancelled job stops even in the middle of an image.
+    for name, func in stages:
+        if item.error or item.skipped:
+            break
+        if cancelled and cancelled():
+            item.error = CANCELLED
+            item.image = item.mask = item.output_image = None
+            break
+        start = time.perf_counter()
+        _run_item(name, func, item, retries, batched=name == "infer")
+        end = time.perf_counter()
+        item.timings[name] = end - start
+        METRICS.observe("stage_seconds", end - start, stage=name)
+        METRICS.span(name, start, end, input=item.input_path)
+    return item
+
+def run_pipeline(image_paths, export_path, workers=None, io_workers=2, queue_size=None,
+                 model_name=utils.DEFAULT_MODEL, providers=None, cache=None,
+                 output_format=utils.DEFAULT_FORMAT, encoder_options=None, thumbnail_size=None,
+                 large_image_pixels=utils.LARGE_IMAGE_PIXELS, tile_memory_mb=utils.TILE_MEMORY_MB, retries=0,
+                 name_template=utils.DEFAULT_NAME_TEMPLATE, skip_existing=False, batch_size=1, runtime=None,
+                 refine=None, dedupe=None):
+    # Stream images through decode -> inference -> post-process -> encode/write and
+    # yield each PipelineItem as soon as it has been written (or has failed).
+    # A failing stage is retried up to retries times before the item is given up on.
+    # Inference takes up to batch_size images per model call; runtime holds ONNX Runtime settings
+    # (models.session_settings), sized for the number of inference workers unless given.
+    # refine holds mask refinement options (masks.refine_mask), None for a plain upscale.
+    # dedupe (dedupe.DuplicateIndex) runs inference once per group of near-identical images.
+    workers = workers or os.cpu_count() or 1
+    # Deep enough that every inference worker can fill a whole batch
+    queue_size = queue_size or workers * max(batch_size, 2)
+    stop = threading.Event()
+    slots = itertools.count()
+    runtime = dict(runtime or {}, workers=workers)
+
+    funcs = dict(build_stages(export_path, model_name, providers, cache, output_format, encoder_options,
+                              thumbnail_size, large_image_pixels, tile_memory_mb, name_template, skip_existing, refine,
+                              dedupe))
+    # (name, func, workers, per-worker setup, batch size or None for single-item stages)
+    stages = [
+        ("decode", funcs["decode"], io_workers, None, None),
+        ("infer", funcs["infer"], workers,
+         lambda: utils._init_worker(slots, model_name, providers, runtime), max(batch_size, 1)),
+        ("postprocess", funcs["postprocess"], io_workers, None, None),
+        ("encode", funcs["encode"], io_workers, None, None),
+    ]
+
+    # Bounded queues between the stages keep at most queue_size images in memory per hop
+    queues = [Queue(maxsize=queue_size) for _ in range(len(stages))]
+    results = Queue()
+
+    threads = []
+    for i, (name, func, count, setup, stage_batch_size) in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else results
+        next_workers = stages[i + 1][2] if i + 1 < len(stages) else 1
+        workers_left = {"count": count, "lock": threading.Lock()}
+        for _ in range(count):
+            thread = threading.Thread(
+                target=_run_stage,
+                args=(name, func, queues[i], outbox, stop, workers_left, next_workers, setup, retries,
+                      stage_batch_size),
+                name=f"pipeline-{name}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+    def feed():
+        try:
+            for index, image_path in enumerate(image_paths):
+                if not _put(queues[0], PipelineItem(index, image_path), stop):
+                    return
+        finally:
+            # Close the stream even if the input iterable raised, so the consumer never hangs
+            for _ in range(stages[0][2]):
+                if not _put(queues[0], _STOP, stop):
+                    break
+
+    feeder = threading.Thread(target=feed, name="pipeline-feed", daemon=True)
+    feeder.start()
+    threads.append(feeder)
+
+    try:
+        while True:
+            item = results.get()
+            if item is _STOP:
+                break
+            METRICS.inc("images_total", status="failed" if item.error else "skipped" if item.skipped else "ok")
+            METRICS.observe("image_seconds", sum(item.timings.values()))
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
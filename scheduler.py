@@ -0,0 +1,188 @@
+import itertools
+import os
+import threading
+import time
+
+from metrics import METRICS
+import pipeline
+import utils
+
+# Shared worker pool for any number of batch jobs. Every worker takes the next image of the highest-priority
+# job that still has work (the oldest job among equals), so an interactive single-image request submitted
+# during a 1,000-image run is picked up by the next free worker instead of waiting for the run to end.
+# While an interactive job is queued or running (and there is more than one worker), one worker is kept
+# free of bulk work, so its next image never waits behind a bulk one; otherwise bulk jobs use every worker.
+
+PRIORITY_BULK = 0
+PRIORITY_INTERACTIVE = 10
+
+class Job:
+    # One submitted batch. status: queued, running, done or cancelled. done/failed count finished images;
+    # images that were cancelled before they finished count as neither and can be resubmitted.
+    def __init__(self, job_id, image_paths, priority, stages, retries, on_result, on_done):
+        self.id = job_id
+        self.image_paths = image_paths
+        self.priority = priority
+        self.total = len(image_paths)
+        self.status = "queued"
+        self.done = 0
+        self.failed = 0
+        self.submitted = time.perf_counter()
+        self.finished = None
+        self._stages = stages
+        self._retries = retries
+        self._on_result = on_result
+        self._on_done = on_done
+        self._next_index = 0
+        self._in_flight = 0
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        # Cooperative: queued images are dropped, images in progress stop before their next stage
+        self._cancel.set()
+
+    def progress(self):
+        return (self.done + self.failed) / self.total if self.total else 1.0
+
+    def _has_work(self):
+        return not self.cancelled and self._next_index < self.total
+
+class JobScheduler:
+    # runtime: ONNX Runtime settings (models.session_settings), sized for the number of workers unless given.
+    # Every worker keeps its own sessions, created on first use for each model the jobs ask for.
+    # interactive_workers: how many workers are kept from bulk work while an interactive job (PRIORITY_INTERACTIVE
+    # or above) is queued or running (default: 1 when there are several workers)
+    def __init__(self, workers=None, runtime=None, interactive_workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        if interactive_workers is None:
+            interactive_workers = 1 if self.workers > 1 else 0
+        # Most workers that may be busy with lower-priority jobs at once while an interactive job is active
+        self._bulk_limit = max(self.workers - interactive_workers, 1)
+        self._bulk_running = 0
+        self._runtime = dict(runtime or {}, workers=self.workers)
+        self._jobs = []
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._closed = False
+        slots = itertools.count()
+        self._threads = [
+            threading.Thread(target=self._worker_loop, args=(slots,), name=f"scheduler-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, image_paths, export_path, priority=PRIORITY_BULK, retries=0, on_result=None, on_done=None,
+               **options):
+        # Queue a batch; options are those of pipeline.build_stages. on_result(job, item) is called from a
+        # worker thread for every finished or failed image, on_done(job) once the job is done or cancelled.
+        image_paths = list(image_paths)
+        stages = pipeline.build_stages(export_path, **options)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("scheduler is shut down")
+            job = Job(next(self._ids), image_paths, priority, stages, retries, on_result, on_done)
+            self._jobs.append(job)
+            self._condition.notify_all()
+        METRICS.inc("jobs_total", status="submitted")
+        if not image_paths:
+            self._finish_if_idle(job)
+        return job
+
+    def cancel(self, job):
+        job.cancel()
+        self._finish_if_idle(job)
+
+    def cancel_all(self):
+        for job in self.jobs():
+            self.cancel(job)
+
+    def jobs(self):
+        # Jobs that are queued or running, highest priority first
+        with self._condition:
+            return sorted(self._jobs, key=lambda job: (-job.priority, job.id))
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            self.cancel_all()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _next(self):
+        # -> (job, item), or None once the scheduler is shut down and there is nothing left to run
+        with self._condition:
+            while True:
+                interactive = any(job.priority >= PRIORITY_INTERACTIVE for job in self._jobs)
+                bulk_limit = self._bulk_limit if interactive else self.workers
+                runnable = [job for job in self._jobs if job._has_work()
+                            and (job.priority >= PRIORITY_INTERACTIVE or self._bulk_running < bulk_limit)]
+                if runnable:
+                    job = min(runnable, key=lambda job: (-job.priority, job.id))
+                    index = job._next_index
+                    job._next_index += 1
+                    job._in_flight += 1
+                    if job.priority < PRIORITY_INTERACTIVE:
+                        self._bulk_running += 1
+                    job.status = "running"
+                    return job, pipeline.PipelineItem(index, job.image_paths[index])
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+    def _worker_loop(self, slots):
+        # Slot and settings for this worker's sessions, as in the pools of run_pipeline and process_images
+        utils._init_worker(slots, None, None, self._runtime)
+        with METRICS.profile_thread():
+            while True:
+                task = self._next()
+                if task is None:
+                    return
+                job, item = task
+                pipeline.process_item(item, job._stages, job._retries, lambda: job.cancelled)
+                self._complete(job, item)
+
+    def _complete(self, job, item):
+        with self._condition:
+            job._in_flight -= 1
+            if job.priority < PRIORITY_INTERACTIVE:
+                self._bulk_running -= 1
+                # A worker held back by the bulk limit may go on now
+                self._condition.notify_all()
+            if item.error != pipeline.CANCELLED:
+                if item.error:
+                    job.failed += 1
+                else:
+                    job.done += 1
+        if item.error != pipeline.CANCELLED:
+            METRICS.inc("images_total", status="failed" if item.error else "skipped" if item.skipped else "ok")
+            METRICS.observe("image_seconds", sum(item.timings.values()))
+            if job._on_result:
+                try:
+                    job._on_result(job, item)
+                except Exception as e:
+                    print(f"Error removing background: {e}")
+        self._finish_if_idle(job)
+
+    def _finish_if_idle(self, job):
+        # A job ends when nothing of it is queued or in progress; only one caller gets to report it
+        with self._condition:
+            if job not in self._jobs or job._in_flight or job._has_work():
+                return
+            self._jobs.remove(job)
+            # Workers held back for an interactive job may take bulk work again
+            self._condition.notify_all()
+            job.status = "cancelled" if job.cancelled else "done"
+            job.finished = time.perf_counter()
+        METRICS.inc("jobs_total", status=job.status)
+        if job._on_done:
+            try:
+                job._on_done(job)
+            except Exception as e:
+                print(f"Error removing background: {e}")
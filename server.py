@@ -0,0 +1,347 @@
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import api
+from cache import cache_key
+from encoders import ENCODERS
+from metrics import METRICS
+import utils
+
+# Long-running local HTTP server: the model sessions stay warm between requests, and uploads that arrive
+# close together go through the model as one batch.
+#
+#   POST /remove?output=rgba|mask&format=png   body: the image file; response: the encoded result
+#   GET  /healthz                              JSON status, 503 while the model is still loading
+#   GET  /metrics                              Prometheus text (metrics.py)
+#
+# Plain asyncio streams, so there is nothing to install beyond the app's own requirements.
+
+CONTENT_TYPES = {".png": "image/png", ".webp": "image/webp"}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class _Job:
+    def __init__(self, image, key, future):
+        self.image = image
+        self.key = key
+        self.future = future
+
+class BackgroundRemovalServer:
+    # workers inference threads, each with its own session, take up to batch_size queued images at a time.
+    # A batch is started batch_wait seconds after its first image at the latest. At most max_queue images
+    # wait for the model, and at most max_in_flight uploads are anywhere between reading the body and
+    # encoding the result (default: a full queue plus a batch per worker); beyond either limit requests get
+    # 503 with Retry-After instead of piling up in memory.
+    def __init__(self, host="127.0.0.1", port=8080, model_name=utils.DEFAULT_MODEL, providers=None, workers=1,
+                 batch_size=4, batch_wait=0.01, max_queue=64, max_upload_bytes=50 * 1024 * 1024, io_workers=2,
+                 cache=None, refine=None, runtime=None, output_format=utils.DEFAULT_FORMAT, max_in_flight=None):
+        self.host = host
+        self.port = port
+        self.model_name = model_name
+        self.providers = providers
+        self.workers = max(workers, 1)
+        self.batch_size = max(batch_size, 1)
+        self.batch_wait = batch_wait
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight or max_queue + self.workers * self.batch_size
+        self.max_upload_bytes = max_upload_bytes
+        self.cache = cache
+        self.refine = refine
+        self.output_format = output_format
+        self.ready = False
+        self._runtime = dict(runtime or {}, workers=self.workers)
+        self._io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="server-io")
+        self._infer_pool = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="server-infer",
+            initializer=utils._init_worker,
+            initargs=(itertools.count(), model_name, providers, self._runtime),
+        )
+        self._queue = None
+        # Admission for /remove: held from reading the upload until its result is encoded
+        self._admission = asyncio.Semaphore(self.max_in_flight)
+        self._server = None
+        self._batchers = []
+        self._connections = set()
+
+    async def start(self):
+        # Returns once the socket listens; port 0 picks a free port, found in self.port afterwards
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._batchers = [loop.create_task(self._batch_loop()) for _ in range(self.workers)]
+        loop.create_task(self._warm_up())
+        return self
+
+    async def _warm_up(self):
+        # Load every worker's session before the first upload; /healthz reports ready afterwards
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._infer_pool, utils.get_session, self.model_name,
+                                                        self.providers) for _ in range(self.workers)))
+            self.ready = True
+        except Exception as e:
+            print(f"Error removing background: {e}", file=sys.stderr)
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        # Idle keep-alive connections would otherwise hold their handlers open
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        for batcher in self._batchers:
+            batcher.cancel()
+        await asyncio.gather(*self._batchers, return_exceptions=True)
+        self._io_pool.shutdown(wait=True, cancel_futures=True)
+        self._infer_pool.shutdown(wait=True, cancel_futures=True)
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(jobs) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    jobs.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Requests whose client went away no longer need a mask
+            jobs = [job for job in jobs if not job.future.done()]
+            if not jobs:
+                continue
+
+            # batch_images_total / batches_total is the average batch size
+            METRICS.inc("batches_total", stage="infer")
+            METRICS.inc("batch_images_total", len(jobs), stage="infer")
+            try:
+                with METRICS.timer("stage_seconds", stage="infer"):
+                    masks = await loop.run_in_executor(
+                        self._infer_pool, utils.cached_masks, [job.image for job in jobs],
+                        [job.key for job in jobs], self.model_name, self.providers, self.cache)
+            except Exception as e:
+                for job in jobs:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+            for job, mask in zip(jobs, masks):
+                if not job.future.done():
+                    job.future.set_result(mask)
+
+    def _decode(self, data):
+        input_image, data = api.load_source(data)
+        key = cache_key(data, self.model_name) if self.cache is not None else None
+        large = input_image.width * input_image.height > utils.LARGE_IMAGE_PIXELS
+        return input_image, (api.proxy_image(input_image) if large else input_image), key, large
+
+    def _finish(self, input_image, mask, large, output, output_format):
+        with METRICS.timer("stage_seconds", stage="postprocess"):
+            if output == "mask":
+                result = api.full_mask(input_image, mask, self.refine, utils.TILE_MEMORY_MB)
+            elif large:
+                result = utils.postprocess_large(input_image, mask, utils.TILE_MEMORY_MB, self.refine)
+            else:
+                result = utils.postprocess(input_image, mask, self.refine)
+        return api.deliver(result, output_format, None, None)
+
+    async def remove(self, data, output="rgba", output_format=None):
+        # The whole request path without HTTP: decode, queue for a batch, post-process and encode
+        output_format = output_format or self.output_format
+        if output not in ("rgba", "mask"):
+            raise HTTPError(400, f"unknown output {output!r} (choose rgba or mask)")
+        if output_format not in ENCODERS:
+            raise HTTPError(400, f"unknown format {output_format!r} (choose from {', '.join(ENCODERS)})")
+        if self._queue.full():
+            raise HTTPError(503, "queue full, retry later")
+
+        loop = asyncio.get_running_loop()
+        with METRICS.timer("stage_seconds", stage="decode"):
+            try:
+                input_image, model_image, key, large = await loop.run_in_executor(self._io_pool, self._decode, data)
+            except Exception as e:
+                raise HTTPError(400, f"cannot read image: {e}") from None
+
+        job = _Job(model_image, key, loop.create_future())
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPError(503, "queue full, retry later") from None
+        try:
+            mask = await job.future
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+
+        return await loop.run_in_executor(self._io_pool, self._finish, input_image, mask, large, output,
+                                          output_format)
+
+    async def _handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive; one request at a time per connection
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, request_line, reader, writer):
+        start = time.perf_counter()
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            self._respond(writer, 400, b"bad request line\n", "text/plain", False)
+            return False
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        status, body, content_type = 200, b"", "text/plain"
+        try:
+            if url.path == "/healthz":
+                status = 200 if self.ready else 503
+                body = json.dumps({
+                    "status": "ok" if self.ready else "loading",
+                    "model": self.model_name,
+                    "queue": self._queue.qsize(),
+                    "max_queue": self.max_queue,
+                }).encode()
+                content_type = "application/json"
+            elif url.path == "/metrics":
+                body = METRICS.render().encode()
+                content_type = "text/plain; version=0.0.4"
+            elif url.path == "/remove":
+                if method != "POST":
+                    raise HTTPError(405, "POST the image file to /remove")
+                # Until the body has been read the connection cannot be reused: whatever is refused on the way
+                # (a missing or malformed Content-Length, 413, 503) leaves its bytes in the stream
+                reusable, keep_alive = keep_alive, False
+                if "content-length" not in headers:
+                    raise HTTPError(411, "Content-Length required")
+                length = int(headers["content-length"])
+                if length > self.max_upload_bytes:
+                    raise HTTPError(413, f"upload larger than {self.max_upload_bytes} bytes")
+                if self._admission.locked():
+                    raise HTTPError(503, "too many uploads in progress, retry later")
+                output_format = query.get("format") or self.output_format
+                async with self._admission:
+                    data = await reader.readexactly(length)
+                    keep_alive = reusable
+                    body = await self.remove(data, query.get("output", "rgba"), output_format)
+                # Suffixes like "_mask.png" end in the file type
+                extension = "." + ENCODERS[output_format][0].rsplit(".", 1)[-1]
+                content_type = CONTENT_TYPES.get(extension, "application/octet-stream")
+            else:
+                raise HTTPError(404, f"no such endpoint: {url.path}")
+        except HTTPError as e:
+            status, body, content_type = e.status, f"{e}\n".encode(), "text/plain"
+        except ValueError as e:
+            status, body, content_type = 400, f"{e}\n".encode(), "text/plain"
+        except Exception as e:
+            print(f"Error removing background: {e}", file=sys.stderr)
+            status, body, content_type = 500, f"{e}\n".encode(), "text/plain"
+
+        self._respond(writer, status, body, content_type, keep_alive)
+        METRICS.inc("http_requests_total", path=url.path, status=str(status))
+        METRICS.observe("http_request_seconds", time.perf_counter() - start, path=url.path)
+        return keep_alive
+
+    def _respond(self, writer, status, body, content_type, keep_alive):
+        headers = [
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == 503:
+            headers.append("Retry-After: 1")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Serve background removal over HTTP on this machine.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("-m", "--model", default=utils.DEFAULT_MODEL, help="segmentation model (default: u2net)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="inference workers, each with its own session")
+    parser.add_argument("-b", "--batch-size", type=int, default=4, help="most uploads per model call (default: 4)")
+    parser.add_argument("--batch-wait-ms", type=float, default=10.0,
+                        help="how long a batch waits for more uploads after its first one (default: 10)")
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="uploads waiting for the model before new ones get 503 (default: 64)")
+    parser.add_argument("--max-in-flight", type=int,
+                        help="uploads being read, queued, processed or encoded at once before new ones get 503 "
+                             "(default: max queue plus a batch per worker)")
+    parser.add_argument("--max-upload-mb", type=float, default=50.0, help="largest accepted upload (default: 50)")
+    parser.add_argument("-f", "--format", dest="output_format", default=utils.DEFAULT_FORMAT,
+                        help="default output format; ?format= overrides it per request (default: png)")
+    parser.add_argument("--no-cache", action="store_true", help="do not reuse masks of identical uploads")
+    parser.add_argument("--feather", action="store_true", help="snap mask edges to the image (guided filter)")
+    parser.add_argument("--matting", action="store_true", help="estimate partial transparency along the edge")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    from cache import MaskCache
+    import models
+
+    if not models.is_known(args.model):
+        print(f"unknown model {args.model!r} (choose from {', '.join(models.available_models())})", file=sys.stderr)
+        return 2
+    refine = {name: True for name in ("feather", "matting") if getattr(args, name)} or None
+    server = BackgroundRemovalServer(
+        args.host, args.port, args.model, workers=args.workers, batch_size=args.batch_size,
+        batch_wait=args.batch_wait_ms / 1000, max_queue=args.max_queue, max_in_flight=args.max_in_flight,
+        max_upload_bytes=int(args.max_upload_mb * 1024 * 1024), cache=None if args.no_cache else MaskCache(),
+        refine=refine, output_format=args.output_format,
+    )
+
+    async def run():
+        await server.start()
+        print(f"Serving {args.model} on http://{args.host}:{server.port}/remove", file=sys.stderr)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+from PIL import Image, ImageOps, UnidentifiedImageError
+import hashlib
+import io
+import os
+import tempfile
+
+DEFAULT_THUMBNAIL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "remove-background-app", "thumbnails")
+
+def thumbnail_file(image_path, size, cache_dir=DEFAULT_THUMBNAIL_DIR):
+    # Keyed by path, mtime and file size, so an edited file gets a fresh thumbnail
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{size}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".png")
+
+def render_thumbnail(image, size):
+    # Shrink an already decoded image to fit a size x size box
+    ImageOps.exif_transpose(image, in_place=True)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    image.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return image
+
+def thumbnail_bytes(image, size):
+    # Small PNG of an in-memory result, without copying the full-size image first
+    scale = min(size / image.width, size / image.height, 1.0)
+    target = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    small = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    small.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+def make_thumbnail(image_path, size=100, cache_dir=DEFAULT_THUMBNAIL_DIR):
+    # Return the path of a cached thumbnail, decoding the source only on a cache miss
+    cached = thumbnail_file(image_path, size, cache_dir)
+    if os.path.exists(cached):
+        return cached
+
+    try:
+        image = Image.open(image_path)
+    except UnidentifiedImageError:
+        # Not an image: a video gets its first frame as thumbnail, any other file is still an error
+        import video
+
+        if not video.is_video(image_path):
+            raise
+        thumbnail = render_thumbnail(video.first_frame(image_path), size)
+    else:
+        with image:
+            # JPEG draft mode decodes straight at 1/2 .. 1/8 scale, skipping most of the full-size decode
+            image.draft("RGB", (size * 2, size * 2))
+            thumbnail = render_thumbnail(image, size)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            thumbnail.save(tmp_file, format="PNG", compress_level=1)
+        os.replace(tmp_path, cached)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return cached
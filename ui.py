@@ -1,39 +1,208 @@
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QPushButton, QLabel, QFileDialog,
     QVBoxLayout, QHBoxLayout, QWidget, QProgressBar, QMessageBox,
-    QScrollArea, QGridLayout, QStackedWidget, QDialog, QLineEdit
+    QScrollArea, QGridLayout, QStackedWidget, QDialog, QLineEdit, QListView, QComboBox,
+    QCheckBox
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSettings
-from PyQt5.QtGui import QPixmap, QFont, QIcon
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal, QSettings, QAbstractListModel, QModelIndex, QSize
+from PyQt5.QtGui import QPixmap, QFont, QIcon, QImageReader
+from collections import OrderedDict
 import sys
 import os
+import threading
+import time
 
-class BackgroundRemovalThread(QThread):
-    progress_signal = pyqtSignal(int)
+THUMBNAIL_SIZE = 100
+# Mask refinement behind the "Refine edges" setting (see masks.refine_mask)
+REFINE_EDGES = {"cleanup": 2, "feather": True, "matting": True}
+
+class JobSignals(QObject):
+    # Hands scheduler callbacks, which run on its worker threads, over to the GUI thread
+    result_signal = pyqtSignal(str, str)
+    thumbnail_signal = pyqtSignal(str, bytes)
+    progress_signal = pyqtSignal()
+    done_signal = pyqtSignal(int, str)
+
+class WatchFolderThread(QThread):
     result_signal = pyqtSignal(str, str)
+    thumbnail_signal = pyqtSignal(str, bytes)
 
-    def __init__(self, image_paths, export_path):
+    def __init__(self, import_folder, export_path, workers=None, output_format="png", model_name="u2net",
+                 refine=None):
         super().__init__()
-        self.image_paths = image_paths
+        self.import_folder = import_folder
         self.export_path = export_path
+        self.workers = workers
+        self.output_format = output_format
+        self.model_name = model_name
+        self.refine = refine
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
 
     def run(self):
         try:
-            from utils import remove_background
-            self.progress_signal.emit(0)
+            from watcher import watch
+            from cache import MaskCache
+
+            for item in watch([self.import_folder], self.export_path, self.stop_event,
+                              workers=self.workers, cache=MaskCache(), output_format=self.output_format,
+                              thumbnail_size=THUMBNAIL_SIZE, model_name=self.model_name, refine=self.refine):
+                if item.output_file:
+                    self.thumbnail_signal.emit(item.output_file, item.thumbnail or b"")
+                    self.result_signal.emit("success", item.output_file)
+                else:
+                    self.result_signal.emit("error", f"Error processing {os.path.basename(item.input_path)}")
+        except Exception as e:
+            self.result_signal.emit("error", str(e))
 
-            for i, image_path in enumerate(self.image_paths):
-                output_file = remove_background(image_path, self.export_path)
-                if not output_file:
-                    self.result_signal.emit("error", f"Error processing {os.path.basename(image_path)}")
-                    return
-                progress = int((i + 1) / len(self.image_paths) * 100)
-                self.progress_signal.emit(progress)
-                self.result_signal.emit("success", output_file)
+class VideoThread(QThread):
+    # The videos of a selection, one after another; each one becomes an image sequence in
+    # <export folder>/<name>_frames, with the model run on keyframes only (see video.py)
+    progress_signal = pyqtSignal(str, int, int)
+    result_signal = pyqtSignal(str, str)
+    thumbnail_signal = pyqtSignal(str, bytes)
+
+    def __init__(self, video_paths, export_path, model_name="u2net", output_format="png", refine=None, workers=None):
+        super().__init__()
+        self.video_paths = video_paths
+        self.export_path = export_path
+        self.model_name = model_name
+        self.output_format = output_format
+        self.refine = refine
+        self.workers = workers
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        for video_path in self.video_paths:
+            if self.stop_event.is_set():
+                return
+            name = os.path.splitext(os.path.basename(video_path))[0]
+            try:
+                from video import remove_video_background
+
+                report = remove_video_background(
+                    video_path, os.path.join(self.export_path, f"{name}_frames"), self.model_name,
+                    output_format=self.output_format, refine=self.refine, workers=self.workers,
+                    progress=lambda done, total: self.progress_signal.emit(name, done, total or 0),
+                    cancelled=self.stop_event.is_set,
+                )
+                if report["first_frame"]:
+                    self.thumbnail_signal.emit(report["first_frame"], b"")
+                self.result_signal.emit("success", report["output"])
+            except Exception as e:
+                print(f"Error removing background: {e}")
+                self.result_signal.emit("error", f"Error processing {os.path.basename(video_path)}")
+
+class WarmUpThread(QThread):
+    # Loads the processing stack (rembg, onnxruntime, OpenCV) and the model sessions while the user is
+    # still picking files, so the first batch starts at steady-state speed
+    def __init__(self, model_name="u2net", workers=None, refine=False):
+        super().__init__()
+        self.model_name = model_name
+        self.workers = workers
+        self.refine = refine
 
-            self.result_signal.emit("done", "")
+    def run(self):
+        try:
+            import pipeline
+            import utils
+            if self.refine:
+                import masks
+            utils.warm_up(self.model_name, workers=self.workers, cancelled=self.isInterruptionRequested)
         except Exception as e:
-            self.result_signal.emit("error", str(e))
+            # Not fatal: the first batch loads whatever is missing and reports the error itself
+            print(f"Error removing background: {e}")
+
+class ThumbnailThread(QThread):
+    thumbnail_signal = pyqtSignal(int, str)
+
+    def __init__(self, image_paths, size, workers=4):
+        super().__init__()
+        self.image_paths = image_paths
+        self.size = size
+        self.workers = workers
+
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        from thumbnails import make_thumbnail
+
+        # Decode off the GUI thread and hand over each thumbnail as soon as it is ready
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(make_thumbnail, image_path, self.size): idx
+                for idx, image_path in enumerate(self.image_paths)
+            }
+            for future in as_completed(futures):
+                if self.isInterruptionRequested():
+                    for pending in futures:
+                        pending.cancel()
+                    return
+                try:
+                    self.thumbnail_signal.emit(futures[future], future.result())
+                except Exception as e:
+                    print(f"Error creating thumbnail: {e}")
+
+class ResultListModel(QAbstractListModel):
+    # Processed images for the result panel. Thumbnails are kept as small PNG bytes and only
+    # the ones the view actually paints are decoded, through a bounded pixmap cache.
+    def __init__(self, thumbnail_size=THUMBNAIL_SIZE, max_pixmaps=200):
+        super().__init__()
+        self.thumbnail_size = thumbnail_size
+        self.max_pixmaps = max_pixmaps
+        self.items = []
+        self.pixmaps = OrderedDict()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        output_file, thumbnail = self.items[index.row()]
+        if role == Qt.DecorationRole:
+            return self.pixmap(index.row(), output_file, thumbnail)
+        if role == Qt.ToolTipRole:
+            return output_file
+        return None
+
+    def pixmap(self, row, output_file, thumbnail):
+        pixmap = self.pixmaps.get(row)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(row)
+            return pixmap
+
+        if thumbnail:
+            pixmap = QPixmap()
+            pixmap.loadFromData(thumbnail, "PNG")
+        else:
+            # No preview from the worker: decode the file at thumbnail size
+            reader = QImageReader(output_file)
+            size = reader.size()
+            size.scale(self.thumbnail_size, self.thumbnail_size, Qt.KeepAspectRatio)
+            reader.setScaledSize(size)
+            pixmap = QPixmap.fromImage(reader.read())
+
+        self.pixmaps[row] = pixmap
+        if len(self.pixmaps) > self.max_pixmaps:
+            self.pixmaps.popitem(last=False)
+        return pixmap
+
+    def add_result(self, output_file, thumbnail=b""):
+        row = len(self.items)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.items.append((output_file, thumbnail))
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.items.clear()
+        self.pixmaps.clear()
+        self.endResetModel()
 
 class FolderSettingsDialog(QDialog):
     def __init__(self, main_app, import_folder, export_folder):
@@ -42,11 +211,30 @@ class FolderSettingsDialog(QDialog):
 
         self.setWindowFlags(Qt.Dialog | Qt.WindowTitleHint | Qt.WindowCloseButtonHint)
         self.setWindowTitle("Set Folder Paths")
-        self.setFixedSize(400, 200)
+        self.setFixedSize(400, 300)
 
         self.import_folder_line_edit = QLineEdit(import_folder)
         self.export_folder_line_edit = QLineEdit(export_folder)
 
+        # Every registered model plus the INT8 variants found in the model folder
+        import models
+        self.model_combo = QComboBox()
+        for name in models.available_models():
+            label = name if models.is_available(name) else f"{name} (downloads on first use)"
+            self.model_combo.addItem(label, name)
+            self.model_combo.setItemData(self.model_combo.count() - 1, models.describe(name), Qt.ToolTipRole)
+        index = self.model_combo.findData(main_app.model_name)
+        if index >= 0:
+            self.model_combo.setCurrentIndex(index)
+
+        self.refine_checkbox = QCheckBox("Refine edges (hair, fur; slower)")
+        self.refine_checkbox.setChecked(main_app.refine_edges)
+
+        self.dedupe_checkbox = QCheckBox("Reuse masks for near-duplicate frames")
+        self.dedupe_checkbox.setToolTip("Bursts and video stills: only the first of a run of near-identical images "
+                                        "goes through the model")
+        self.dedupe_checkbox.setChecked(main_app.dedupe)
+
         # Styling for buttons
         button_style = """
             QPushButton {
@@ -96,8 +284,16 @@ class FolderSettingsDialog(QDialog):
         export_layout.addWidget(self.export_folder_line_edit)
         export_layout.addWidget(browse_export_button)
 
+        # Model Layout
+        model_layout = QHBoxLayout()
+        model_layout.addWidget(QLabel("Model:"))
+        model_layout.addWidget(self.model_combo, 1)
+
         layout.addLayout(import_layout)
         layout.addLayout(export_layout)
+        layout.addLayout(model_layout)
+        layout.addWidget(self.refine_checkbox)
+        layout.addWidget(self.dedupe_checkbox)
 
         button_layout = QHBoxLayout()
         button_layout.addStretch()
@@ -125,22 +321,60 @@ class FolderSettingsDialog(QDialog):
         if import_folder and export_folder:
             self.main_app.settings.setValue("import_folder", import_folder)
             self.main_app.settings.setValue("export_path", export_folder)
+            self.main_app.settings.setValue("model", self.model_combo.currentData())
+            self.main_app.settings.setValue("refine_edges", self.refine_checkbox.isChecked())
+            self.main_app.settings.setValue("dedupe", self.dedupe_checkbox.isChecked())
             self.main_app.settings.sync()
+            model_changed = self.main_app.model_name != self.model_combo.currentData()
+            self.main_app.model_name = self.model_combo.currentData()
+            self.main_app.refine_edges = self.refine_checkbox.isChecked()
+            self.main_app.dedupe = self.dedupe_checkbox.isChecked()
             self.main_app.import_folder = import_folder
             self.main_app.export_path = export_folder
+            if model_changed:
+                self.main_app.start_warm_up()
             self.close()
 
 class RemoveBGApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.settings = QSettings("RemoveBGApp", "Settings")
-        self.bg_thread = None
+        # Batches run as jobs on a shared worker pool (scheduler.py), created on the first batch
+        self.scheduler = None
+        self.jobs = {}
+        # One journal per export folder, shared by every job writing there
+        self.journals = {}
+        # Job id -> (journal, whole selection) for jobs resuming an interrupted selection, whose progress
+        # counts the images the journal already has
+        self.job_selections = {}
+        self.job_signals = JobSignals()
+        # Queued even when emitted from the GUI thread, so a job never reports back before it is registered
+        self.job_signals.result_signal.connect(self.update_ui_after_removal, Qt.QueuedConnection)
+        self.job_signals.thumbnail_signal.connect(self.add_result_thumbnail, Qt.QueuedConnection)
+        self.job_signals.progress_signal.connect(self.update_job_progress, Qt.QueuedConnection)
+        self.job_signals.done_signal.connect(self.update_ui_after_job, Qt.QueuedConnection)
+        self.watch_thread = None
+        # Videos of the selection run beside the image jobs, one thread at a time
+        self.video_thread = None
+        self.warm_up_thread = None
+        self.warm_up_again = False
+        self.thumbnail_thread = None
         self.image_paths = []
         self.processed_images = []
 
         # Retrieve import and export paths from QSettings
         self.import_folder = self.settings.value("import_folder", "")
         self.export_path = self.settings.value("export_path", "")
+        # 0 lets the worker pool pick one worker per CPU core
+        self.workers = self.settings.value("workers", 0, type=int)
+        # png, webp, webp-lossy or mask (see encoders.py)
+        self.output_format = self.settings.value("output_format", "png")
+        # Segmentation model (see models.py); u2netp or an INT8 variant is much faster on CPU
+        self.model_name = self.settings.value("model", "u2net")
+        # Speck cleanup, feathering and matting of the mask edge (REFINE_EDGES)
+        self.refine_edges = self.settings.value("refine_edges", False, type=bool)
+        # One inference per group of near-identical selected images (see dedupe.py)
+        self.dedupe = self.settings.value("dedupe", False, type=bool)
 
         # Variables for dragging the window
         self.old_pos = self.pos()
@@ -148,6 +382,9 @@ class RemoveBGApp(QMainWindow):
 
         self.initUI()
 
+        # Once the event loop runs, i.e. after the window is on screen
+        QTimer.singleShot(0, self.start_warm_up)
+
         if not self.export_path:
             self.prompt_initial_settings()
 
@@ -350,14 +587,26 @@ class RemoveBGApp(QMainWindow):
         self.browse_button.clicked.connect(self.browse_images)
         left_panel.addWidget(self.browse_button)
 
+        # Watch the import folder and process new or changed images as they arrive
+        self.watch_button = QPushButton("Watch Import Folder")
+        self.watch_button.setStyleSheet(button_style)
+        self.watch_button.clicked.connect(self.toggle_watch_folder)
+        left_panel.addWidget(self.watch_button)
+
         # Right Panel Layout
         right_panel = QVBoxLayout()
-        self.right_scroll_area = QScrollArea()
-        self.right_scroll_area.setWidgetResizable(True)
-        self.right_scroll_content = QWidget()
-        self.right_scroll_layout = QGridLayout(self.right_scroll_content)
-        self.right_scroll_area.setWidget(self.right_scroll_content)
-        right_panel.addWidget(self.right_scroll_area)
+        # Results are appended one at a time; the list view only paints the visible thumbnails
+        self.result_model = ResultListModel()
+        self.result_view = QListView()
+        self.result_view.setModel(self.result_model)
+        self.result_view.setViewMode(QListView.IconMode)
+        self.result_view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.result_view.setGridSize(QSize(THUMBNAIL_SIZE + 10, THUMBNAIL_SIZE + 10))
+        self.result_view.setUniformItemSizes(True)
+        self.result_view.setMovement(QListView.Static)
+        self.result_view.setResizeMode(QListView.Adjust)
+        self.result_view.setLayoutMode(QListView.Batched)
+        right_panel.addWidget(self.result_view)
 
         # ปุ่ม "Remove Background" ในพาเนลขวา
         self.remove_bg_button = QPushButton("Remove Background")
@@ -366,6 +615,13 @@ class RemoveBGApp(QMainWindow):
         self.remove_bg_button.setEnabled(False) 
         right_panel.addWidget(self.remove_bg_button)
 
+        # Stops every queued and running batch; finished images are kept and a rerun continues from there
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setStyleSheet(button_style)
+        self.cancel_button.clicked.connect(self.cancel_jobs)
+        self.cancel_button.setVisible(False)
+        right_panel.addWidget(self.cancel_button)
+
         # เพิ่มพาเนลซ้ายและขวาเข้าใน content_layout
         content_layout.addLayout(left_panel)
         content_layout.addLayout(right_panel)
@@ -418,15 +674,100 @@ class RemoveBGApp(QMainWindow):
     def close_app(self):
         self.close()
 
+    def start_warm_up(self):
+        if self.warm_up_thread and self.warm_up_thread.isRunning():
+            # Still loading the previous model; go again for the new one when it is done
+            self.warm_up_again = True
+            return
+        self.warm_up_again = False
+        self.warm_up_thread = WarmUpThread(self.model_name, self.workers or None, self.refine_edges)
+        self.warm_up_thread.finished.connect(self.update_ui_after_warm_up)
+        if self.loading_label.text() == "Ready":
+            self.loading_label.setText(f"Loading {self.model_name}...")
+        self.warm_up_thread.start()
+
+    def update_ui_after_warm_up(self):
+        if self.warm_up_again:
+            self.start_warm_up()
+            return
+        # Only replace the warm-up message, never the status of a batch that started meanwhile
+        if self.loading_label.text().startswith("Loading "):
+            self.loading_label.setText("Ready")
+
+    def closeEvent(self, event):
+        if self.warm_up_thread:
+            # Stops after the session being loaded instead of going through every worker's
+            self.warm_up_again = False
+            self.warm_up_thread.requestInterruption()
+            self.warm_up_thread.wait()
+        if self.scheduler:
+            # Running images stop before their next stage; the journals keep the rest for a rerun
+            self.scheduler.shutdown()
+        for journal in self.journals.values():
+            journal.close()
+        if self.thumbnail_thread:
+            self.thumbnail_thread.requestInterruption()
+            self.thumbnail_thread.wait()
+        if self.watch_thread:
+            self.watch_thread.stop()
+            self.watch_thread.wait()
+        if self.video_thread:
+            self.video_thread.stop()
+            self.video_thread.wait()
+        # Release the shared model sessions, but only if processing was ever started
+        if "utils" in sys.modules:
+            sys.modules["utils"].release_sessions()
+        super().closeEvent(event)
+
     def browse_images(self):
         file_names, _ = QFileDialog.getOpenFileNames(
-            self, "Open Images", self.import_folder, "Image Files (*.png *.jpg *.jpeg)"
+            self, "Open Images", self.import_folder,
+            "Images and Videos (*.png *.jpg *.jpeg *.mp4 *.mov *.avi *.mkv *.webm *.m4v);;"
+            "Image Files (*.png *.jpg *.jpeg);;Videos (*.mp4 *.mov *.avi *.mkv *.webm *.m4v)"
         )
         if file_names:
             self.image_paths = file_names
             self.processed_images.clear()
             self.display_uploaded_images()
 
+    def toggle_watch_folder(self):
+        if self.watch_thread:
+            self.watch_thread.stop()
+            self.watch_thread.wait()
+            self.watch_thread = None
+            self.watch_button.setText("Watch Import Folder")
+            self.loading_label.setText("Ready")
+            self.loading_label.setStyleSheet("color: #2c3e50;")
+            return
+
+        if not self.import_folder or not os.path.isdir(self.import_folder):
+            self.show_popup("Import folder path is not set or does not exist.")
+            return
+        if not self.export_path or not os.path.isdir(self.export_path):
+            self.show_popup("Export folder path is not set or does not exist.")
+            return
+
+        self.processed_images.clear()
+        self.result_model.clear()
+
+        self.watch_thread = WatchFolderThread(
+            self.import_folder, self.export_path, self.workers or None, self.output_format, self.model_name,
+            REFINE_EDGES if self.refine_edges else None
+        )
+        self.watch_thread.result_signal.connect(self.update_ui_after_watch)
+        self.watch_thread.thumbnail_signal.connect(self.result_model.add_result)
+        self.watch_thread.start()
+        self.watch_button.setText("Stop Watching")
+        self.loading_label.setText(f"Watching {self.import_folder} for new images...")
+        self.loading_label.setStyleSheet("color: #e67e22;")
+
+    def update_ui_after_watch(self, status, output_file):
+        if status == "success":
+            self.processed_images.append(output_file)
+        else:
+            self.loading_label.setText(output_file)
+            self.loading_label.setStyleSheet("color: #e74c3c;")
+
     def display_uploaded_images(self):
         for i in reversed(range(self.left_scroll_layout.count())): 
             widget = self.left_scroll_layout.itemAt(i).widget()
@@ -447,52 +788,90 @@ class RemoveBGApp(QMainWindow):
             }
         """)
 
-        display_size = 100
+        display_size = THUMBNAIL_SIZE
 
-        for idx, image_path in enumerate(self.image_paths):
-            pixmap = QPixmap(image_path)
-            if not pixmap.isNull():
-                label = QLabel()
-                scaled_pixmap = pixmap.scaled(
-                    display_size, display_size, Qt.KeepAspectRatio, Qt.SmoothTransformation
-                )
-                label.setPixmap(scaled_pixmap)
-                label.setFixedSize(display_size, display_size)
-                self.left_scroll_layout.addWidget(label, idx // 2, idx % 2)
+        # Thumbnails stream in from a background thread; drop any still loading for a previous selection
+        if self.thumbnail_thread:
+            self.thumbnail_thread.thumbnail_signal.disconnect(self.add_uploaded_thumbnail)
+            self.thumbnail_thread.requestInterruption()
+            self.thumbnail_thread.wait()
+        self.thumbnail_thread = ThumbnailThread(list(self.image_paths), display_size)
+        self.thumbnail_thread.thumbnail_signal.connect(self.add_uploaded_thumbnail)
+        self.thumbnail_thread.start()
 
         self.loading_label.setText("Ready")
 
+    def add_uploaded_thumbnail(self, idx, thumbnail_path):
+        display_size = THUMBNAIL_SIZE
+        pixmap = QPixmap(thumbnail_path)
+        if not pixmap.isNull():
+            label = QLabel()
+            label.setPixmap(pixmap)
+            label.setFixedSize(display_size, display_size)
+            self.left_scroll_layout.addWidget(label, idx // 2, idx % 2)
+
     def start_background_removal(self):
         if self.image_paths:
-            for i in reversed(range(self.right_scroll_layout.count())): 
-                widget = self.right_scroll_layout.itemAt(i).widget()
-                if widget:
-                    widget.setParent(None)
+            from cache import MaskCache
+            from journal import BatchJournal
+            from scheduler import JobScheduler, PRIORITY_BULK, PRIORITY_INTERACTIVE
+            from dedupe import DuplicateIndex
+            from video import is_video
+
+            video_paths = [path for path in self.image_paths if is_video(path)]
+            if video_paths and self.video_thread:
+                self.show_popup("A video is still being processed. Wait for it or cancel it first.")
+                return
+            if not self.jobs and not self.video_thread:
+                # Nothing else running: start a fresh result list
+                self.result_model.clear()
+                self.processed_images.clear()
+            if video_paths:
+                self.start_video_removal(video_paths)
+            if len(video_paths) == len(self.image_paths):
+                return
+            if self.scheduler is None:
+                self.scheduler = JobScheduler(self.workers or None)
+            journal = self.journals.get(self.export_path)
+            if journal is None:
+                journal = self.journals[self.export_path] = BatchJournal(self.export_path, resume=True)
+
+            selection = [path for path in self.image_paths if not is_video(path)]
+            image_paths = selection
+            # Rerunning an interrupted selection picks up where it stopped; a finished one runs again
+            resuming = journal.progress(selection)[0] < len(selection)
+            if resuming:
+                image_paths = list(journal.track(selection))
+            signals = self.job_signals
+
+            def on_result(job, item):
+                journal.record(item.input_path, item.output_file, item.error, item.attempts)
+                if item.error:
+                    # One bad file only costs itself; the rest of the batch carries on
+                    signals.result_signal.emit("error", f"Error processing {os.path.basename(item.input_path)}")
+                else:
+                    signals.thumbnail_signal.emit(item.output_file, item.thumbnail or b"")
+                    signals.result_signal.emit("success", item.output_file)
+                signals.progress_signal.emit()
+
+            def on_done(job):
+                signals.done_signal.emit(job.id, f"{job.failed} of {job.total} images failed." if job.failed else "")
+
+            # A single image goes ahead of any batch that is already running
+            priority = PRIORITY_INTERACTIVE if len(image_paths) == 1 else PRIORITY_BULK
+            job = self.scheduler.submit(
+                image_paths, self.export_path, priority, retries=1, on_result=on_result, on_done=on_done,
+                cache=MaskCache(), output_format=self.output_format, thumbnail_size=THUMBNAIL_SIZE,
+                model_name=self.model_name, refine=REFINE_EDGES if self.refine_edges else None,
+                dedupe=DuplicateIndex() if self.dedupe else None,
+            )
+            self.jobs[job.id] = job
+            if resuming:
+                self.job_selections[job.id] = (journal, selection)
 
-            self.loading_label.setText("Removing background, please wait...")
-            self.loading_label.setStyleSheet("color: #e67e22;")
-            self.remove_bg_button.setEnabled(False)
-            self.remove_bg_button.setStyleSheet("""
-                QPushButton {
-                    background-color: gray;
-                    color: brown;
-                    border-radius: 5px; 
-                    padding: 10px;
-                }
-                QPushButton:disabled {
-                    background-color: gray;
-                    color: brown;
-                }
-            """)
             self.progress_bar.setVisible(True)
-            self.progress_bar.setValue(0)
-
-            self.processed_images.clear()
-
-            self.bg_thread = BackgroundRemovalThread(self.image_paths, self.export_path)
-            self.bg_thread.progress_signal.connect(self.update_progress_bar)
-            self.bg_thread.result_signal.connect(self.update_ui_after_removal)
-            self.bg_thread.start()
+            self.cancel_button.setVisible(True)
+            self.update_job_progress()
         else:
             self.loading_label.setText("Please select images first.")
             self.loading_label.setStyleSheet("color: #e74c3c;")
@@ -539,17 +918,115 @@ class RemoveBGApp(QMainWindow):
     def update_progress_bar(self, value):
         self.progress_bar.setValue(value)
 
+    def add_result_thumbnail(self, output_file, thumbnail):
+        self.result_model.add_result(output_file, thumbnail)
+
+    def update_job_progress(self):
+        # One progress bar over every active job, and a status entry per job
+        from metrics import status_line
+
+        jobs = sorted(self.jobs.values(), key=lambda job: job.id)
+        if not jobs:
+            return
+        total = finished = 0
+        for job in jobs:
+            if job.id in self.job_selections:
+                # The journal covers the whole selection, including what earlier runs finished
+                journal, selection = self.job_selections[job.id]
+                total += len(selection)
+                finished += sum(journal.progress(selection))
+            else:
+                total += job.total
+                finished += job.done + job.failed
+        self.update_progress_bar(int(finished / total * 100) if total else 100)
+        now = time.perf_counter()
+        statuses = []
+        for job in jobs:
+            if job.cancelled:
+                statuses.append(f"Job {job.id}: cancelling")
+            elif job.status == "queued":
+                statuses.append(f"Job {job.id}: queued, {job.total} images")
+            else:
+                statuses.append(f"Job {job.id}: " + status_line(job.done + job.failed, job.total, now - job.submitted))
+        self.loading_label.setText("   |   ".join(statuses))
+        self.loading_label.setStyleSheet("color: #e67e22;")
+
+    def cancel_jobs(self):
+        if self.scheduler:
+            self.scheduler.cancel_all()
+        if self.video_thread:
+            self.video_thread.stop()
+        self.update_job_progress()
+
+    def start_video_removal(self, video_paths):
+        self.video_thread = VideoThread(
+            video_paths, self.export_path, self.model_name, self.output_format,
+            REFINE_EDGES if self.refine_edges else None, self.workers or None,
+        )
+        self.video_thread.progress_signal.connect(self.update_video_progress)
+        self.video_thread.result_signal.connect(self.update_ui_after_removal)
+        self.video_thread.thumbnail_signal.connect(self.add_result_thumbnail)
+        self.video_thread.finished.connect(self.update_ui_after_video)
+        self.video_thread.start()
+        self.progress_bar.setVisible(True)
+        self.cancel_button.setVisible(True)
+        self.loading_label.setText("Processing video...")
+        self.loading_label.setStyleSheet("color: #e67e22;")
+
+    def update_video_progress(self, name, done, total):
+        if self.jobs:
+            # Image jobs own the status line while they run
+            return
+        if total:
+            self.update_progress_bar(int(done / total * 100))
+            self.loading_label.setText(f"Video {name}: frame {done} of {total}")
+        else:
+            self.loading_label.setText(f"Video {name}: frame {done}")
+
+    def update_ui_after_video(self):
+        cancelled = self.video_thread.stop_event.is_set()
+        self.video_thread = None
+        if self.jobs:
+            self.update_job_progress()
+            return
+        self.cancel_button.setVisible(False)
+        self.update_ui_after_removal("cancelled" if cancelled else "done", "")
+        if cancelled:
+            # Unlike image batches, a video starts over from its first frame
+            self.loading_label.setText("Cancelled. The frames done so far are in the export folder.")
+
+    def update_ui_after_job(self, job_id, message):
+        job = self.jobs.pop(job_id, None)
+        self.job_selections.pop(job_id, None)
+        if self.jobs or self.video_thread:
+            # Other jobs are still going; their progress takes over the status line
+            self.update_job_progress()
+            return
+        self.cancel_button.setVisible(False)
+        if job and job.status == "cancelled":
+            self.update_ui_after_removal("cancelled", message)
+        else:
+            self.update_ui_after_removal("done", message)
+
     def update_ui_after_removal(self, status, output_file):
         if status == "success":
             self.processed_images.append(output_file)
-            self.display_processed_images()
         elif status == "done":
             self.progress_bar.setVisible(False)
-            self.loading_label.setText("Backgrounds removed successfully!")
-            self.loading_label.setStyleSheet("color: #27ae60;")
+            if output_file:
+                # Some images failed; the journal in the export folder lists them and a rerun retries only those
+                self.loading_label.setText(f"Backgrounds removed. {output_file} Run again to retry them.")
+                self.loading_label.setStyleSheet("color: #e67e22;")
+            else:
+                self.loading_label.setText("Backgrounds removed successfully!")
+                self.loading_label.setStyleSheet("color: #27ae60;")
             self.open_export_folder()
+        elif status == "cancelled":
+            self.progress_bar.setVisible(False)
+            self.loading_label.setText("Cancelled. Run the same images again to continue where they stopped.")
+            self.loading_label.setStyleSheet("color: #e67e22;")
         else:
-            self.loading_label.setText("Error processing images.")
+            self.loading_label.setText(output_file or "Error processing images.")
             self.loading_label.setStyleSheet("color: #e74c3c;")
 
     def open_export_folder(self):
@@ -563,25 +1040,6 @@ class RemoveBGApp(QMainWindow):
         else:
             self.show_popup("Export folder path is not set or does not exist.")
 
-    def display_processed_images(self):
-        for i in reversed(range(self.right_scroll_layout.count())): 
-            widget = self.right_scroll_layout.itemAt(i).widget()
-            if widget:
-                widget.setParent(None)
-
-        display_size = 100
-
-        for idx, processed_image in enumerate(self.processed_images):
-            pixmap = QPixmap(processed_image)
-            if not pixmap.isNull():
-                label = QLabel()
-                scaled_pixmap = pixmap.scaled(
-                    display_size, display_size, Qt.KeepAspectRatio, Qt.SmoothTransformation
-                )
-                label.setPixmap(scaled_pixmap)
-                label.setFixedSize(display_size, display_size)
-                self.right_scroll_layout.addWidget(label, idx // 2, idx % 2)
-
     # Implement mouse events for dragging
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
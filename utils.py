@@ -1,38 +1,386 @@
-from rembg import remove
-from PIL import Image
 import os
+# rembg imports pymatting, which compiles numba kernels at import time. Under numba's default threading
+# layer, doing that on any thread but the main one hangs the interpreter on exit, which rules out loading
+# the processing stack in the background. rembg's alpha matting is never used here, so the plain
+# workqueue layer costs nothing.
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+# rembg is imported here even though models.py creates the sessions, so importing utils loads the whole stack
+import rembg
+from PIL import Image, ImageOps
+from cache import cache_key
+from encoders import DEFAULT_FORMAT, encode, output_suffix
+from metrics import METRICS
+import models
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import io
+import itertools
+import multiprocessing
+import numpy as np
+import sys
+import threading
 import time
 
-def remove_background(input_path, export_path):
+DEFAULT_MODEL = "u2net"
+
+# Process-wide registry of rembg sessions, keyed by model name and provider options
+_sessions = {}
+_sessions_lock = threading.Lock()
+# One lock per session key, so workers of a pool load their sessions side by side
+_session_locks = {}
+
+# Pool workers get their own slot so every worker keeps a warm session of its own
+_worker = threading.local()
+
+def _session_key(model_name, providers):
+    return (model_name, tuple(providers) if providers else None, getattr(_worker, "slot", None))
+
+def get_session(model_name=DEFAULT_MODEL, providers=None):
+    # Create the ONNX inference session lazily on first use and share it afterwards
+    key = _session_key(model_name, providers)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            lock = _session_locks.setdefault(key, threading.Lock())
+        with lock:
+            session = _sessions.get(key)
+            if session is None:
+                runtime = getattr(_worker, "runtime", None) or {}
+                with METRICS.timer("model_load_seconds", model=model_name):
+                    session = models.create_session(model_name, providers, **runtime)
+                _sessions[key] = session
+    return session
+
+def warm_up(model_name=DEFAULT_MODEL, providers=None, workers=None, runtime=None, cancelled=None):
+    # Load the sessions a batch of this many workers will use, and run each once so its first real image
+    # does not pay for ONNX Runtime's lazy allocations. Safe to call from a background thread while the
+    # user is still picking files: a batch started meanwhile waits for the session instead of loading it twice.
+    # cancelled() returning True stops before the next session, so a caller never waits for more than one load.
+    workers = workers or os.cpu_count() or 1
+    saved = _worker.__dict__.copy()
     try:
-        # Open the image
-        input_image = Image.open(input_path)
-        # Get the original size of the image
-        original_size = input_image.size
-        
-        # Process the image using rembg and U-2-Net model
-        output_image = remove(input_image)
-
-        # Resize the output image to match the original size
-        output_image = output_image.resize(original_size, Image.Resampling.LANCZOS)
-
-        # Create a unique file name based on the current timestamp and original file name
-        base_name = os.path.basename(input_path)
-        name, ext = os.path.splitext(base_name)
-        timestamp = int(time.time())
-
-        # Save as PNG if transparency (RGBA) exists, otherwise save as JPEG
-        if output_image.mode == "RGBA":
-            new_name = f"{name}_{timestamp}.png"
-            output_file = os.path.join(export_path, new_name)
-            output_image.save(output_file, format="PNG", quality=95)
-        else:
-            new_name = f"{name}_{timestamp}.jpg"
-            output_file = os.path.join(export_path, new_name)
-            output_image = output_image.convert("RGB")  # Convert to RGB for JPEG
-            output_image.save(output_file, format="JPEG", quality=95)
+        with METRICS.timer("startup_seconds", phase="warm_up", model=model_name):
+            for slot in range(workers):
+                if cancelled and cancelled():
+                    break
+                # Same slots and settings as the pool workers of process_images and run_pipeline
+                _worker.slot = slot
+                _worker.runtime = dict(runtime or {}, workers=workers)
+                predict_mask(Image.new("RGB", (64, 64)), model_name, providers)
+    finally:
+        _worker.__dict__.clear()
+        _worker.__dict__.update(saved)
+
+def release_sessions():
+    # Drop every cached session so onnxruntime can free the model memory
+    with _sessions_lock:
+        _sessions.clear()
+
+# The per-image work is split into stages so the pipeline can overlap them
+def read_input(input_path):
+    with open(input_path, "rb") as input_file:
+        return input_file.read()
+
+def load_image(input_path, data=None):
+    # Open the image and decode it now, while we are still on the I/O stage
+    input_image = Image.open(io.BytesIO(data) if data is not None else input_path)
+    input_image.load()
+    # Apply the EXIF orientation up front so the mask and the pixels always line up
+    ImageOps.exif_transpose(input_image, in_place=True)
+    return input_image
+
+# Images above this many pixels take the large-image path: inference on a bounded proxy and
+# tiled mask upscaling, so the per-image working memory does not grow with the pixel count
+LARGE_IMAGE_PIXELS = 16_000_000
+PROXY_SIDE = 1024
+TILE_MEMORY_MB = 64
+
+def is_large_image(input_path, data=None, large_image_pixels=LARGE_IMAGE_PIXELS):
+    if not large_image_pixels:
+        return False
+    # Only the header is read here
+    with Image.open(io.BytesIO(data) if data is not None else input_path) as input_image:
+        width, height = input_image.size
+    return width * height > large_image_pixels
+
+def load_proxy(input_path, data=None, max_side=PROXY_SIDE):
+    # Decode a bounded-size copy for inference; JPEG draft mode skips most of the full-size decode
+    input_image = Image.open(io.BytesIO(data) if data is not None else input_path)
+    input_image.draft("RGB", (max_side, max_side))
+    input_image.load()
+    ImageOps.exif_transpose(input_image, in_place=True)
+    input_image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return input_image
+
+def _normalize(input_image, mean, std, size):
+    # Downscale straight to the model input; reducing_gap lets PIL shrink large photos cheaply first
+    if input_image.mode != "RGB":
+        input_image = input_image.convert("RGB")
+    small = np.asarray(input_image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0), dtype=np.float32)
+    small /= max(float(small.max()), 1.0)
+    small -= np.asarray(mean, dtype=np.float32)
+    small /= np.asarray(std, dtype=np.float32)
+    return np.expand_dims(small.transpose((2, 0, 1)), 0)
+
+def _prediction_to_mask(pred):
+    # Stretch the raw model output to 0..255 like rembg does
+    ma = float(pred.max())
+    mi = float(pred.min())
+    pred = (pred - mi) / ((ma - mi) or 1.0)
+    return Image.fromarray((pred * 255).astype("uint8"), mode="L")
+
+def predict_mask(input_image, model_name=DEFAULT_MODEL, providers=None):
+    # Run the shared model session; the mask comes back at the model's native (low) resolution
+    session = get_session(model_name, providers)
+    spec = models.model_input(model_name)
+    if spec is None:
+        # Models with custom pre/post-processing go through rembg and return a full-size mask
+        with METRICS.timer("step_seconds", step="inference"):
+            return session.predict(input_image)[0]
+
+    with METRICS.timer("step_seconds", step="preprocess"):
+        inputs = {session.inner_session.get_inputs()[0].name: _normalize(input_image, *spec)}
+    with METRICS.timer("step_seconds", step="inference"):
+        ort_outs = session.inner_session.run(None, inputs)
+    return _prediction_to_mask(ort_outs[0][0, 0, :, :])
+
+def _batchable(session):
+    # Only graphs exported with a dynamic (or larger than 1) batch dimension accept stacked inputs
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int) or batch_dim > 1
+
+def predict_masks(input_images, model_name=DEFAULT_MODEL, providers=None):
+    # Run several images through a single session call and split the output back into one mask per image
+    spec = models.model_input(model_name)
+    session = get_session(model_name, providers)
+    if spec is None or len(input_images) == 1 or not _batchable(session):
+        return [predict_mask(input_image, model_name, providers) for input_image in input_images]
+
+    with METRICS.timer("step_seconds", step="preprocess"):
+        batch = np.concatenate([_normalize(input_image, *spec) for input_image in input_images])
+    with METRICS.timer("step_seconds", step="inference", batch=len(input_images)):
+        ort_outs = session.inner_session.run(None, {session.inner_session.get_inputs()[0].name: batch})
+    return [_prediction_to_mask(ort_outs[0][i, 0, :, :]) for i in range(len(input_images))]
+
+def cached_masks(input_images, keys, model_name=DEFAULT_MODEL, providers=None, cache=None):
+    # Batched cached_mask: only the cache misses go to the model, together
+    masks = [None] * len(input_images)
+    if cache is not None:
+        for i, key in enumerate(keys):
+            if key is not None:
+                masks[i] = cache.get(key)
+                METRICS.inc("mask_cache_total", result="miss" if masks[i] is None else "hit")
+
+    missing = [i for i, mask in enumerate(masks) if mask is None]
+    if missing:
+        predicted = predict_masks([input_images[i] for i in missing], model_name, providers)
+        for i, mask in zip(missing, predicted):
+            masks[i] = mask
+            if cache is not None and keys[i] is not None:
+                cache.put(keys[i], mask)
+    return masks
+
+def cached_mask(input_image, key, model_name=DEFAULT_MODEL, providers=None, cache=None):
+    # Reuse a previously computed mask for identical input bytes instead of running inference
+    if cache is not None and key is not None:
+        mask = cache.get(key)
+        METRICS.inc("mask_cache_total", result="miss" if mask is None else "hit")
+        if mask is not None:
+            return mask
+    mask = predict_mask(input_image, model_name, providers)
+    if cache is not None and key is not None:
+        cache.put(key, mask)
+    return mask
+
+def postprocess(input_image, mask, refine=None):
+    # Only the single-channel mask is upscaled; the original pixels are never resampled, and the RGBA result
+    # is built in place (attach_alpha) instead of compositing a copy.
+    # refine: keyword options of masks.refine_mask (threshold, cleanup, feather, matting), None to skip
+    if refine:
+        from masks import refine_mask
+
+        with METRICS.timer("step_seconds", step="mask_refine"):
+            mask = refine_mask(input_image, mask, **refine)
+    elif mask.size != input_image.size:
+        with METRICS.timer("step_seconds", step="mask_resize"):
+            mask = mask.resize(input_image.size, Image.Resampling.BILINEAR)
+    return attach_alpha(input_image, mask)
 
+# Pixels per band when clearing transparent pixels, so the scratch buffers stay small for any image size
+CLEAR_BAND_PIXELS = 1 << 20
+_TRANSPARENT_LUT = [255] + [0] * 255
+
+def attach_alpha(input_image, mask):
+    # putalpha turns the decoded image into the RGBA result in place. Fully transparent pixels are then set
+    # to transparent black, as a composite would leave them: their old background colours would otherwise
+    # roughly double the encoded size and reappear in any viewer that ignores alpha.
+    if input_image.mode not in ("RGB", "RGBA"):
+        input_image = input_image.convert("RGB")
+    input_image.putalpha(mask)
+    # A 1-bit paste mask copies instead of blending, which is several times faster
+    rows = max(1, min(CLEAR_BAND_PIXELS // mask.width, mask.height))
+    black = Image.new("RGBA", (mask.width, rows), 0)
+    for top in range(0, mask.height, rows):
+        box = (0, top, mask.width, min(top + rows, mask.height))
+        transparent = mask.crop(box).point(_TRANSPARENT_LUT, "1")
+        input_image.paste(black if box[3] - top == rows else black.crop((0, 0, mask.width, box[3] - top)), box,
+                          transparent)
+    return input_image
+
+# Output names come from the input, never the clock, so reruns replace their earlier result instead of
+# piling up duplicates. Template fields: {name} and {ext} of the input file, {model}, and {hash}, the first
+# 12 hex digits of the input bytes hashed together with the model and every setting that changes the written
+# file (output_settings). Other settings give another name, so --skip-existing never keeps a stale result.
+DEFAULT_NAME_TEMPLATE = "{name}_{hash}"
+
+def needs_hash(name_template):
+    return "{hash" in name_template
+
+def output_settings(encoder_options=None, refine=None, large_image_pixels=LARGE_IMAGE_PIXELS,
+                    tile_memory_mb=TILE_MEMORY_MB):
+    # Processing settings besides the model and format that end up in the output file
+    return {
+        "encoder_options": encoder_options or {},
+        "refine": refine or {},
+        "large_image_pixels": large_image_pixels,
+        "tile_memory_mb": tile_memory_mb,
+    }
+
+def output_path(input_path, export_path, output_format=DEFAULT_FORMAT, name_template=DEFAULT_NAME_TEMPLATE,
+                key=None, model_name=DEFAULT_MODEL, settings=None):
+    # key: the mask cache key of the input (cache_key of its bytes and the model)
+    name, ext = os.path.splitext(os.path.basename(input_path))
+    digest = cache_key(key.encode(), model_name, output_format=output_format, **(settings or {})) if key else ""
+    fields = {"name": name, "ext": ext.lstrip("."), "model": model_name, "hash": digest[:12]}
+    return os.path.join(export_path, name_template.format(**fields) + output_suffix(output_format))
+
+def is_up_to_date(input_path, output_file):
+    # An existing output at least as new as its source does not need to be produced again
+    try:
+        return os.path.getmtime(output_file) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+def save_output(output_image, output_file, output_format=DEFAULT_FORMAT, encoder_options=None):
+    # Encode into a hidden temporary file next to the target and rename it into place,
+    # so nobody ever sees a partially written output
+    directory, base_name = os.path.split(output_file)
+    # The name template may place outputs in subfolders
+    os.makedirs(directory or ".", exist_ok=True)
+    tmp_path = os.path.join(directory, f".{base_name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as output, METRICS.timer("step_seconds", step="encode"):
+            encode(output_image, output, output_format, **(encoder_options or {}))
+        os.replace(tmp_path, output_file)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return output_file
+
+def postprocess_large(input_image, mask, tile_memory_mb=TILE_MEMORY_MB, refine=None):
+    # Same result as postprocess for an image whose mask came from a proxy: feathering and matting, when refine
+    # asks for them, run tile by tile within tile_memory_mb; otherwise the mask gets a plain bilinear upscale,
+    # which needs no working memory beyond the full-size alpha itself
+    from masks import refine_mask
+
+    with METRICS.timer("step_seconds", step="mask_resize"):
+        full_mask = refine_mask(input_image, mask, tile_memory_mb=tile_memory_mb, **(refine or {}))
+    return attach_alpha(input_image, full_mask)
+
+def remove_background(input_path, export_path, model_name=DEFAULT_MODEL, providers=None, cache=None,
+                      output_format=DEFAULT_FORMAT, encoder_options=None,
+                      large_image_pixels=LARGE_IMAGE_PIXELS, tile_memory_mb=TILE_MEMORY_MB,
+                      name_template=DEFAULT_NAME_TEMPLATE, skip_existing=False, refine=None):
+    start = time.perf_counter()
+    try:
+        with METRICS.timer("stage_seconds", stage="decode"):
+            data = read_input(input_path)
+            key = cache_key(data, model_name) if cache is not None or needs_hash(name_template) else None
+            settings = output_settings(encoder_options, refine, large_image_pixels, tile_memory_mb)
+            output_file = output_path(input_path, export_path, output_format, name_template, key, model_name,
+                                      settings)
+            if skip_existing and is_up_to_date(input_path, output_file):
+                METRICS.inc("images_total", status="skipped")
+                return output_file
+            large = is_large_image(input_path, data, large_image_pixels)
+            input_image = load_proxy(input_path, data) if large else load_image(input_path, data)
+        with METRICS.timer("stage_seconds", stage="infer"):
+            mask = cached_mask(input_image, key, model_name, providers, cache)
+        with METRICS.timer("stage_seconds", stage="postprocess"):
+            if large:
+                output_image = postprocess_large(load_image(input_path, data), mask, tile_memory_mb, refine)
+            else:
+                output_image = postprocess(input_image, mask, refine)
+        with METRICS.timer("stage_seconds", stage="encode"):
+            save_output(output_image, output_file, output_format, encoder_options)
+        METRICS.inc("images_total", status="ok")
         return output_file
     except Exception as e:
-        print(f"Error removing background: {e}")
+        print(f"Error removing background: {e}", file=sys.stderr)
+        METRICS.inc("images_total", status="failed")
         return None
+    finally:
+        METRICS.observe("image_seconds", time.perf_counter() - start)
+
+def _init_worker(slots, model_name, providers, runtime=None):
+    # runtime: ONNX Runtime settings for this worker's session (see models.session_settings)
+    _worker.slot = next(slots)
+    _worker.runtime = runtime
+    # Warm the model before the first image reaches this worker; without a model name the sessions
+    # are created on first use
+    if model_name:
+        get_session(model_name, providers)
+
+def _timed_remove_background(input_path, export_path, options, retries=0):
+    start = time.perf_counter()
+    for _ in range(retries + 1):
+        output_file = remove_background(input_path, export_path, **options)
+        if output_file:
+            break
+    return output_file, time.perf_counter() - start
+
+def process_images(image_paths, export_path, workers=None, use_processes=False,
+                   max_in_flight=None, model_name=DEFAULT_MODEL, providers=None, retries=0, runtime=None,
+                   **options):
+    # Spread the images over a pool and yield (input_path, output_file, seconds) as each one finishes.
+    # A failed image is retried up to retries times; extra keyword options are passed on to remove_background.
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    # Size every session's thread pool for its share of the cores
+    runtime = dict(runtime or {}, workers=workers)
+    pool_options = dict(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(itertools.count(), model_name, providers, runtime),
+    )
+    if use_processes:
+        # Spawn instead of fork: forking after onnxruntime started its thread pools can deadlock
+        executor = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"), **pool_options)
+    else:
+        executor = ThreadPoolExecutor(**pool_options)
+
+    options.update(model_name=model_name, providers=providers)
+    paths = iter(image_paths)
+    pending = {}
+
+    def submit_next():
+        for image_path in paths:
+            future = executor.submit(_timed_remove_background, image_path, export_path, options, retries)
+            pending[future] = image_path
+            return
+
+    try:
+        # Keep the in-flight queue bounded so a huge batch is not submitted all at once
+        for _ in range(max_in_flight):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_path = pending.pop(future)
+                submit_next()
+                output_file, seconds = future.result()
+                yield image_path, output_file, seconds
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,273 @@
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from dedupe import fingerprint, hamming
+from encoders import ENCODERS, output_suffix
+from metrics import METRICS
+import utils
+
+# Background removal for videos and image sequences. Only keyframes go through the model: every
+# keyframe_interval-th frame, plus any frame whose hash has drifted more than scene_distance bits from the
+# last keyframe (a cut, or motion too fast to follow). The frames in between take the previous frame's mask
+# moved along the dense optical flow between the two frames, which costs a fraction of an inference.
+# Frames are streamed: only the ones waiting to be post-processed and encoded are held in memory, however
+# long the video is.
+#
+#   python video.py turntable.mp4 -o frames/          # PNG sequence
+#   python video.py turntable.mp4 -o cutout.mov       # video with alpha (needs ffmpeg)
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v")
+SEQUENCE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+DEFAULT_KEYFRAME_INTERVAL = 8
+DEFAULT_SCENE_DISTANCE = 12
+# Frame rate of image sequences, and of videos that do not report one
+DEFAULT_FPS = 25.0
+# Video output container -> (ffmpeg codec, pixel format); all of them keep the alpha channel
+ALPHA_CODECS = {".mov": ("qtrle", "argb"), ".webm": ("libvpx-vp9", "yuva420p"), ".mkv": ("ffv1", "bgra")}
+
+def is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+def open_source(source):
+    # -> (frame iterator of RGB images, fps, frame count or None). source: a video file, or a folder whose
+    # images, sorted by name, are the frames.
+    if os.path.isdir(source):
+        paths = sorted(entry.path for entry in os.scandir(source)
+                       if entry.is_file() and entry.name.lower().endswith(SEQUENCE_EXTENSIONS))
+        return (utils.load_image(path) for path in paths), DEFAULT_FPS, len(paths)
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video: {source}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+
+    def frames():
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        finally:
+            capture.release()
+    return frames(), fps, count
+
+def first_frame(source):
+    # Poster frame, for thumbnails
+    frames, _, _ = open_source(source)
+    try:
+        frame = next(frames, None)
+    finally:
+        frames.close()
+    if frame is None:
+        raise ValueError(f"No frames in {source}")
+    return frame
+
+def propagate_mask(mask, previous_thumb, thumb):
+    # Move the previous frame's mask to this frame. The flow runs backwards (this frame -> previous), so
+    # every mask pixel samples the spot its content came from and the warped mask has no holes.
+    flow = cv2.calcOpticalFlowFarneback(thumb, previous_thumb, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+    flow = cv2.resize(flow, mask.size, interpolation=cv2.INTER_LINEAR)
+    grid_x, grid_y = np.meshgrid(np.arange(mask.width, dtype=np.float32), np.arange(mask.height, dtype=np.float32))
+    map_x = grid_x + flow[..., 0] * (mask.width / thumb.shape[1])
+    map_y = grid_y + flow[..., 1] * (mask.height / thumb.shape[0])
+    warped = cv2.remap(np.asarray(mask), map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return Image.fromarray(warped, mode="L")
+
+def find_ffmpeg():
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg is needed for video output; write a PNG sequence to a folder instead")
+    return ffmpeg
+
+class AlphaVideoWriter:
+    # Pipes raw RGBA frames into ffmpeg; OpenCV's VideoWriter would drop the alpha channel
+    def __init__(self, path, size, fps):
+        suffix = os.path.splitext(path)[1].lower()
+        if suffix not in ALPHA_CODECS:
+            raise ValueError(f"No alpha-capable codec for {suffix} (choose from {', '.join(ALPHA_CODECS)})")
+        codec, pixel_format = ALPHA_CODECS[suffix]
+        self.size = size
+        self._process = subprocess.Popen(
+            [find_ffmpeg(), "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba",
+             "-s", f"{size[0]}x{size[1]}", "-r", f"{fps:g}", "-i", "-", "-c:v", codec, "-pix_fmt", pixel_format, path],
+            stdin=subprocess.PIPE,
+        )
+
+    def write(self, image):
+        if image.size != self.size:
+            raise ValueError(f"Frame size {image.size} differs from the video's {self.size}")
+        self._process.stdin.write(image.tobytes())
+
+    def close(self):
+        self._process.stdin.close()
+        status = self._process.wait()
+        if status:
+            raise RuntimeError(f"ffmpeg exited with status {status}")
+
+    def abort(self):
+        self._process.kill()
+        self._process.wait()
+
+def remove_video_background(source, output, model_name=utils.DEFAULT_MODEL, providers=None,
+                            output_format=utils.DEFAULT_FORMAT, encoder_options=None,
+                            keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, scene_distance=DEFAULT_SCENE_DISTANCE,
+                            refine=None, workers=None, max_in_flight=None, progress=None, cancelled=None):
+    # output: a folder for an image sequence (<name>_000001.png, ... in output_format), or a .mov, .webm or
+    # .mkv file for a video with alpha. keyframe_interval 1 infers every frame. Post-processing and encoding
+    # run on workers threads, with at most max_in_flight frames waiting for them.
+    # progress(done, total) is called after every frame (total is None when the video does not say);
+    # cancelled() returning True stops after the frames already in progress. -> report dict
+    to_video = os.path.splitext(output)[1].lower() in ALPHA_CODECS
+    if to_video:
+        find_ffmpeg()
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    else:
+        os.makedirs(output, exist_ok=True)
+    frames, fps, total = open_source(source)
+    name = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+    suffix = output_suffix(output_format)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+
+    def frame_file(index):
+        return os.path.join(output, f"{name}_{index:06d}{suffix}")
+
+    def finish(frame, mask, index):
+        with METRICS.timer("stage_seconds", stage="postprocess"):
+            result = utils.postprocess(frame, mask, refine)
+        if to_video:
+            return result
+        with METRICS.timer("stage_seconds", stage="encode"):
+            return utils.save_output(result, frame_file(index), output_format, encoder_options)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = collections.deque()
+    writer = None
+    done = keyframes = 0
+    start = time.perf_counter()
+
+    def drain():
+        # Results are taken in frame order, which the video writer needs
+        nonlocal writer, done
+        result = pending.popleft().result()
+        if to_video:
+            if writer is None:
+                writer = AlphaVideoWriter(output, result.size, fps)
+            writer.write(result)
+        done += 1
+        if progress:
+            progress(done, total)
+
+    try:
+        previous_thumb = mask = key_hash = None
+        since_keyframe = 0
+        for index, frame in enumerate(frames, 1):
+            if cancelled and cancelled():
+                break
+            with METRICS.timer("stage_seconds", stage="track"):
+                frame_hash, thumb = fingerprint(frame)
+                thumb = thumb.astype(np.uint8)
+            keyframe = (previous_thumb is None or previous_thumb.shape != thumb.shape
+                        or since_keyframe >= keyframe_interval or hamming(key_hash, frame_hash) > scene_distance)
+            if keyframe:
+                with METRICS.timer("stage_seconds", stage="infer"):
+                    mask = utils.predict_mask(frame, model_name, providers)
+                key_hash = frame_hash
+                since_keyframe = 0
+                keyframes += 1
+            else:
+                with METRICS.timer("stage_seconds", stage="propagate"):
+                    mask = propagate_mask(mask, previous_thumb, thumb)
+            since_keyframe += 1
+            previous_thumb = thumb
+            METRICS.inc("video_frames_total", kind="keyframe" if keyframe else "propagated")
+            pending.append(executor.submit(finish, frame, mask, index))
+            if len(pending) >= max_in_flight:
+                drain()
+        while pending:
+            drain()
+        if writer:
+            writer.close()
+            writer = None
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        frames.close()
+        if writer:
+            writer.abort()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "input": source,
+        "output": output,
+        # For previews: the first frame of an image sequence
+        "first_frame": frame_file(1) if done and not to_video else None,
+        "frames": done,
+        "keyframes": keyframes,
+        "propagated": done - keyframes,
+        "seconds": round(elapsed, 4),
+        "frames_per_sec": round(done / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Remove the background from every frame of a video or image "
+                                                 "sequence, inferring only on keyframes.")
+    parser.add_argument("input", help="video file, or folder of frames (sorted by name)")
+    parser.add_argument("-o", "--output", required=True,
+                        help="folder for an image sequence, or a .mov, .webm or .mkv file for a video with alpha")
+    parser.add_argument("-m", "--model", default=utils.DEFAULT_MODEL, help="segmentation model (default: u2net)")
+    parser.add_argument("-f", "--format", dest="output_format", default=utils.DEFAULT_FORMAT,
+                        help="image sequence format: png, webp, webp-lossy or mask (default: png)")
+    parser.add_argument("--keyframe-interval", type=int, default=DEFAULT_KEYFRAME_INTERVAL,
+                        help="run the model on every Nth frame and propagate its mask to the frames in between "
+                             "(default: 8, 1 infers every frame)")
+    parser.add_argument("--scene-distance", type=int, default=DEFAULT_SCENE_DISTANCE, metavar="BITS",
+                        help="start a new keyframe early when a frame's 64-bit hash differs from the last "
+                             "keyframe's in more than BITS bits (default: 12)")
+    parser.add_argument("-w", "--workers", type=int, help="post-processing and encoding threads (default: all cores)")
+    parser.add_argument("--feather", action="store_true", help="snap mask edges to the frame (guided filter)")
+    parser.add_argument("--matting", action="store_true", help="estimate partial transparency along the edge")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    import models
+
+    if not models.is_known(args.model):
+        print(f"unknown model {args.model!r} (choose from {', '.join(models.available_models())})", file=sys.stderr)
+        return 2
+    if args.output_format not in ENCODERS:
+        print(f"unknown format {args.output_format!r} (choose from {', '.join(ENCODERS)})", file=sys.stderr)
+        return 2
+    if args.keyframe_interval < 1:
+        print("--keyframe-interval must be at least 1", file=sys.stderr)
+        return 2
+    refine = {name: True for name in ("feather", "matting") if getattr(args, name)} or None
+    try:
+        report = remove_video_background(
+            args.input, args.output, args.model, output_format=args.output_format,
+            keyframe_interval=args.keyframe_interval, scene_distance=args.scene_distance, refine=refine,
+            workers=args.workers,
+        )
+    except Exception as e:
+        print(f"Error removing background: {e}", file=sys.stderr)
+        return 1
+    finally:
+        utils.release_sessions()
+    print(json.dumps(report))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
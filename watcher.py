@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from inputs import DEFAULT_PATTERNS, iter_inputs
+
+MANIFEST_NAME = ".removebg_manifest.json"
+
+class FolderWatcher:
+    # Polls the watched folders and reports images that are new or changed since their last export.
+    # What has been exported is kept in a manifest next to the outputs, so restarts pick up where they left off.
+    def __init__(self, folders, export_path, patterns=None, recursive=False, settle_seconds=1.0):
+        self.folders = folders
+        self.patterns = patterns or DEFAULT_PATTERNS
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self.manifest_path = os.path.join(export_path, MANIFEST_NAME)
+        self.manifest = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as manifest_file:
+                    self.manifest = json.load(manifest_file)
+            except (OSError, ValueError) as e:
+                print(f"Error reading watch manifest: {e}", file=sys.stderr)
+
+    def poll(self):
+        ready = []
+        now = time.time()
+        for path in iter_inputs(self.folders, self.patterns, self.recursive):
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Skip files that are still being copied into the folder
+            if now - stat.st_mtime < self.settle_seconds:
+                continue
+            entry = self.manifest.get(path)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+            ready.append(path)
+        return ready
+
+    def mark(self, path, output_file, error=None):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        entry = {"mtime": stat.st_mtime, "size": stat.st_size, "output": output_file}
+        if error:
+            # Remember failures too, so a broken file is only retried once it changes
+            entry["error"] = error
+        with self._lock:
+            self.manifest[os.path.abspath(path)] = entry
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self.manifest, indent=1)
+        directory = os.path.dirname(self.manifest_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, self.manifest_path)
+
+def watch(folders, export_path, stop, interval=2.0, patterns=None, recursive=False, **pipeline_options):
+    # Yield a PipelineItem for every new or changed image until stop is set
+    from pipeline import run_pipeline
+
+    watcher = FolderWatcher(folders, export_path, patterns, recursive)
+    while not stop.is_set():
+        ready = watcher.poll()
+        if not ready:
+            stop.wait(interval)
+            continue
+
+        try:
+            for item in run_pipeline(ready, export_path, **pipeline_options):
+                watcher.mark(item.input_path, item.output_file, item.error)
+                yield item
+                if stop.is_set():
+                    break
+        finally:
+            watcher.save()